@@ -1,40 +1,156 @@
+import time
+
+# Start of the script run, for the startup span of a session's first page
+SCRIPT_STARTED = time.perf_counter()
+
 import streamlit as st
+import streamlit.components.v1 as components
 import os
+import sys
+import openai
 from openai import OpenAI
-import anthropic
+import httpx
 from io import BytesIO
 import base64
 from streamlit_mic_recorder import mic_recorder
-from streamlit.runtime import get_instance
+from streamlit.runtime import exists as runtime_exists, get_instance
 from streamlit.runtime.scriptrunner import get_script_run_ctx
 import re
-from docx import Document
 import tomllib
 import hmac
+import random
+import gzip
+import json
+import hashlib
+import secrets
 import warnings
 import io
 import logging
+import sqlite3
+import queue
+import atexit
 import uuid
-import time
 import threading
+import functools
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import MappingProxyType
+
+IMPORTS_FINISHED = time.perf_counter()
+
+
+class SessionContextFilter(logging.Filter):
+    """Tags each record with the session and turn of the script run that logged it"""
+
+    def filter(self, record):
+        record.session = record.turn = None
+        ctx = get_script_run_ctx(suppress_warning=True)
+        if ctx is not None:
+            try:
+                state = ctx.session_state
+                record.session = state["session_id"] if "session_id" in state else None
+                record.turn = state["turn"] if "turn" in state else None
+            except Exception:
+                pass
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Hands records to the logging thread instead of writing them on the calling thread.
+
+    Only the message itself is rendered here, because its arguments may change
+    before the logging thread gets to it; tracebacks, JSON encoding and all
+    file and console I/O happen on the logging thread.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single line of JSON"""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "module": record.module,
+            "thread": record.threadName,
+            "func": record.funcName,
+            "line": record.lineno,
+            "session": getattr(record, "session", None),
+            "turn": getattr(record, "turn", None),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SizeAndTimeRotatingFileHandler(RotatingFileHandler):
+    """Rotates the log file when it grows past max_bytes or when interval seconds have passed"""
+
+    def __init__(self, filename, max_bytes, interval, backup_count):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval
+
+    def shouldRollover(self, record):
+        if self.interval and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.interval
+
+
+def attach_queue_listener(logger, *handlers):
+    """Send the logger's records through a queue to handlers run by a background thread"""
+    records = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(records)
+    logger.addHandler(queue_handler)
+    listener = QueueListener(records, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    return queue_handler
 
 
 # Create a custom logger
 def get_logger():
+    """Logger whose records are written by a background thread.
+
+    Script threads only put records on a queue. A listener thread writes them to a
+    rotating JSON Lines file and to the console, as configured in [logging].
+    """
     log = logging.getLogger(__name__)
     if not log.hasHandlers():  # Avoid adding handlers multiple times
-        log.setLevel(logging.INFO)
-        file_handler = logging.FileHandler("log.txt", mode="a", encoding="utf-8")
+        try:
+            settings = tomllib.load(open("settings.toml", "rb")).get("logging", {})
+        except Exception:
+            settings = {}
+        log.setLevel(settings.get("level", "INFO"))
+        file_handler = SizeAndTimeRotatingFileHandler(
+            settings.get("file", "log.txt"),
+            max_bytes=int(settings.get("max_mb", 10) * 1024 * 1024),
+            interval=settings.get("rotate_hours", 24) * 3600,
+            backup_count=settings.get("backup_count", 7),
+        )
+        file_handler.setFormatter(JsonFormatter())
         console_handler = logging.StreamHandler()
-        formatter = logging.Formatter(
-            "{asctime}\t{levelname}\t{module}\t{threadName}\t{funcName}\t{lineno}\n{message}",
-            style="{",
+        console_handler.setFormatter(
+            logging.Formatter(
+                "{asctime}\t{levelname}\t{module}\t{threadName}\t{funcName}\t{lineno}\t{session}\n{message}",
+                style="{",
+            )
         )
-        file_handler.setFormatter(formatter)
-        console_handler.setFormatter(formatter)
-        log.addHandler(file_handler)
-        log.addHandler(console_handler)
+        attach_queue_listener(log, file_handler, console_handler).addFilter(SessionContextFilter())
     return log
 
 
@@ -44,6 +160,60 @@ log = st.session_state.logger
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
+TTS_MODEL = "tts-1"
+
+# Voices offered by the TTS endpoint
+TTS_VOICES = {"alloy", "ash", "ballad", "coral", "echo", "fable", "nova", "onyx", "sage", "shimmer", "verse"}
+
+# Name, avatar and TTS voice of each agent, overridable in the [sam] and [noa] sections of settings.toml
+DEFAULT_AGENTS = {
+    "sam": {"name": "Sam Richards", "avatar": "assets/Sam.jpg", "voice": "onyx"},
+    "noa": {"name": "Noa Martinez", "avatar": "assets/Noa.jpg", "voice": "nova"},
+}
+
+# Avatar of the student in the chat
+USER_AVATAR = "assets/User.png"
+
+# Anthropic model used when [providers] routes chat replies to Anthropic
+DEFAULT_ANTHROPIC_MODEL = "claude-sonnet-4-5"
+
+# Chat model settings, overridable in the [parameters] section of settings.toml
+DEFAULT_PARAMETERS = {
+    "model": "gpt-4o",
+    "temperature": 0.7,
+    "streaming_tts": True,
+    "render_interval_ms": 50,
+    "speculative_debrief": True,
+    "worker_threads": 8,
+    "tts_threads": 8,
+}
+
+# Chat display settings, overridable in the [display] section of settings.toml
+DEFAULT_DISPLAY = {"visible_messages": 12}
+
+# Fixed lines spoken at the phase transitions, overridable in the [scripts] section of settings.toml
+DEFAULT_SCRIPTS = {
+    "welcome": "Hi there! I'm Noa Martinez, one of the clinical instructors here at Columbia. I'll be guiding you through today's simulation. We're going to practice some change management skills in a challenging setting - implementing a flu vaccination program at a county corrections facility. You'll be meeting with Sam Richards, the Operations Manager there. He's been in his position for 14 years and, between us, he's known for being pretty resistant to change. Your goal is to persuade him to support your vaccination program despite his objections. Do you have any questions before we start, or would you like to discuss your approach?",
+    "transition": "Great! I'll introduce you to Sam now. Remember to focus on addressing his specific concerns while emphasizing the benefits to his facility. Good luck!",
+    "sam_intro": "Hello, I'm Sam Richards, Operations Manager here at the County Corrections Facility. I understand you're here about some flu vaccination program? Look, I've got 500 inmates to manage, an understaffed facility, and security concerns you wouldn't believe. I'm not sure how you expect this to work in our environment. What exactly are you proposing?",
+    "debrief_intro": "So, how do you think that went? That wasn't easy - Sam can be quite challenging! I was really impressed with how you managed to stay calm and professional throughout the conversation, especially when he brought up some tough concerns. Let me give you some feedback on your performance.",
+}
+
+# Agent that speaks each scripted line
+SCRIPT_AGENTS = {"welcome": "noa", "transition": "noa", "sam_intro": "sam", "debrief_intro": "noa"}
+
+# Microphone recorder that sends audio in segments while the student is still speaking
+chunked_recorder = components.declare_component(
+    "chunked_recorder",
+    path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "chunked_recorder"),
+)
+
+# Hidden player that plays every speech clip of the session through the same <audio> elements
+audio_player = components.declare_component(
+    "audio_player",
+    path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "audio_player"),
+)
+
 
 def get_uuid():
     timestamp = time.time()
@@ -79,13 +249,330 @@ def elapsed(start):
     return dur_str
 
 
+def current_phase():
+    """Name of the simulation phase the session is in"""
+    if st.session_state.get("debrief_active"):
+        return "debrief"
+    if st.session_state.get("sam_active"):
+        return "sam"
+    return "prebrief"
+
+
+# Phrases that signal a phase transition, matched as whole words
+TRANSITION_SIGNALS = {
+    # The student agrees to start the meeting with Sam
+    "ready": [
+        "ready", "begin", "start", "yes", "yeah", "yep", "sure", "ok", "okay",
+        "let's", "meet sam", "meet with sam", "proceed", "go",
+    ],
+    # The student wants to end the meeting with Sam
+    "feedback": ["ready for feedback", "end session", "finish", "complete", "goodbye"],
+    # Noa asks whether the student is ready to meet Sam
+    "invitation": ["ready to start", "ready to meet", "would you like to meet", "shall we begin"],
+    # The student or Sam is wrapping up the meeting
+    "wind_down": [
+        "thank you for your time", "thanks for your time", "thank you for meeting", "thanks for meeting",
+        "appreciate your time", "next steps", "follow up", "wrap up", "before I go", "have a good day",
+        "I'll be in touch", "I'll send you", "send me", "I'll think about it", "we can try", "let's try it",
+        "sounds like a plan", "I'll take it to", "run it by",
+    ],
+}
+
+# Signal that moves each phase on, and the phase it moves to
+PHASE_TRANSITIONS = {"prebrief": ("ready", "sam"), "sam": ("feedback", "debrief")}
+
+
+def phrase_pattern(phrase):
+    """Regex for a phrase that tolerates any whitespace and a missing or curly apostrophe"""
+    return re.escape(phrase).replace(r"\ ", r"\s+").replace("'", "['’]?")
+
+
+def compile_signals(signals):
+    """Compile all signal phrases into one case-insensitive regex.
+
+    Each signal is an optional lookahead tried at every word boundary, so
+    overlapping phrases of different signals ("ready" and "ready to meet")
+    are all reported in a single pass over the text.
+    """
+    lookaheads = "".join(
+        rf"(?:(?=(?P<{name}>{'|'.join(phrase_pattern(p) for p in sorted(phrases, key=len, reverse=True))})\b))?"
+        for name, phrases in signals.items()
+    )
+    return re.compile(rf"\b{lookaheads}", re.IGNORECASE)
+
+
+SIGNAL_MATCHER = compile_signals(TRANSITION_SIGNALS)
+
+
+def find_signals(text):
+    """Names of the transition signals that occur in text"""
+    return {name for match in SIGNAL_MATCHER.finditer(text) for name, value in match.groupdict().items() if value}
+
+
+def next_phase(phase, text):
+    """Phase a student message moves the simulation to, or None if it stays in phase"""
+    signal, target = PHASE_TRANSITIONS.get(phase, (None, None))
+    return target if signal in find_signals(text) else None
+
+
+class ReadinessTracker:
+    """Decides when to offer the "I'm Ready to Meet Sam" button during the pre-brief.
+
+    The button is offered when the student signalled readiness within the last
+    six messages, when Noa asked whether they're ready within the last three
+    (once there are six), or once the pre-brief reaches ten messages. Each
+    message is scanned once as it is added; the history is never rescanned.
+    """
+
+    def __init__(self):
+        self.seen = 0
+        self.last_ready = None  # index of the latest student message signalling readiness
+        self.last_invitation = None  # index of the latest message in which Noa asked
+
+    def update(self, messages):
+        if len(messages) < self.seen:  # the conversation was restarted
+            self.__init__()
+        for index in range(self.seen, len(messages)):
+            message = messages[index]
+            if message["role"] == "user" and "ready" in find_signals(message["content"]):
+                self.last_ready = index
+            elif (
+                message["role"] == "assistant"
+                and message.get("agent", "noa") == "noa"
+                and "invitation" in find_signals(message["content"])
+            ):
+                self.last_invitation = index
+        self.seen = len(messages)
+
+    def ready(self, messages):
+        self.update(messages)
+        count = len(messages)
+        if count < 2:
+            return False
+        if self.last_ready is not None and self.last_ready >= count - 6:
+            return True
+        if count >= 6 and self.last_invitation is not None and self.last_invitation >= count - 3:
+            return True
+        return count >= 10
+
+
+class SessionRecorder:
+    """Records one session as a replayable fixture.
+
+    Each event (user input, chat reply, speech clip, transcription) is appended
+    as a JSON line to a gzip file with its offset from the session start, so
+    tools/replay.py can replay the session with the same content and timings.
+    """
+
+    def __init__(self, directory, session_id):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{datetime.now():%Y%m%d-%H%M%S}-{session_id}.jsonl.gz")
+        self.start = time.time()
+        self.lock = threading.Lock()
+
+    def record(self, kind, **fields):
+        line = json.dumps({"t": round(time.time() - self.start, 3), "kind": kind, **fields})
+        with self.lock, gzip.open(self.path, "at", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def record_event(kind, **fields):
+    """Add an event to this session's recording, if recording is enabled"""
+    recorder = st.session_state.get("session_recorder")
+    if recorder:
+        try:
+            recorder.record(kind, phase=current_phase(), **fields)
+        except Exception as e:
+            log.exception(f"Error recording session event: {e}")
+
+
+def timed(function, *args, **kwargs):
+    """Call function and return its result together with the elapsed seconds"""
+    started = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - started
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list of numbers"""
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class Tracer:
+    """Collects timing spans from all sessions.
+
+    Every span is appended to a JSON Lines sink together with its session and
+    turn id. A logging thread writes the sink and rotates it like log.txt. The
+    most recent durations of each span name are kept in memory for the p50/p95
+    figures served by the metrics endpoint. Numeric attributes such as bytes or
+    frames get p50/p95 figures of their own.
+    """
+
+    def __init__(self, sink=None, window=1000, max_mb=10, rotate_hours=24, backup_count=7):
+        self.sink = None
+        if sink:
+            self.sink = logging.getLogger(f"{__name__}.traces")
+            self.sink.propagate = False
+            self.sink.setLevel(logging.INFO)
+            if not self.sink.handlers:
+                file_handler = SizeAndTimeRotatingFileHandler(
+                    sink,
+                    max_bytes=int(max_mb * 1024 * 1024),
+                    interval=rotate_hours * 3600,
+                    backup_count=backup_count,
+                )
+                file_handler.setFormatter(logging.Formatter("%(message)s"))
+                attach_queue_listener(self.sink, file_handler)
+        self.window = window
+        self.lock = threading.Lock()
+        self.durations = {}  # span name -> recent durations in seconds
+        self.values = {}  # span name -> attribute -> recent numeric values
+
+    def observe(self, name, seconds, **attrs):
+        line = json.dumps({"ts": round(time.time(), 3), "span": name, "seconds": round(seconds, 4), **attrs})
+        with self.lock:
+            self.durations.setdefault(name, deque(maxlen=self.window)).append(seconds)
+            for attr, value in attrs.items():
+                if attr != "turn" and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.values.setdefault(name, {}).setdefault(attr, deque(maxlen=self.window)).append(value)
+        if self.sink:
+            self.sink.info(line)
+
+    def metrics(self):
+        """Count, p50, p95 and max duration of each span name, and p50/p95 of its numeric attributes"""
+        with self.lock:
+            snapshot = {name: list(durations) for name, durations in self.durations.items()}
+            values = {
+                name: {attr: list(recent) for attr, recent in attrs.items()} for name, attrs in self.values.items()
+            }
+        metrics = {}
+        for name, durations in sorted(snapshot.items()):
+            metrics[name] = {
+                "count": len(durations),
+                "p50": round(percentile(durations, 0.50), 4),
+                "p95": round(percentile(durations, 0.95), 4),
+                "max": round(max(durations), 4),
+            }
+            for attr, recent in sorted(values.get(name, {}).items()):
+                metrics[name][attr] = {
+                    "p50": round(percentile(recent, 0.50), 4),
+                    "p95": round(percentile(recent, 0.95), 4),
+                }
+        return metrics
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the tracer's span percentiles as JSON at /metrics"""
+
+    tracer = None
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = json.dumps(self.tracer.metrics(), indent=2).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("Metrics server: " + format, *args)
+
+
+@st.cache_resource
+def get_tracer():
+    """Create the process-wide tracer and start its metrics endpoint, or return None when tracing is off"""
+    tracing = get_settings().get("tracing", {})
+    if not tracing.get("enabled", True):
+        return None
+    tracer = Tracer(
+        tracing.get("sink", "traces.jsonl") or None,
+        tracing.get("window", 1000),
+        max_mb=tracing.get("max_mb", 10),
+        rotate_hours=tracing.get("rotate_hours", 24),
+        backup_count=tracing.get("backup_count", 7),
+    )
+    port = tracing.get("metrics_port", 8503)
+    if port:
+        try:
+            handler = type("Handler", (MetricsHandler,), {"tracer": tracer})
+            server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+            log.info("Metrics endpoint at http://127.0.0.1:%s/metrics", server.server_address[1])
+        except Exception as e:
+            log.exception(f"Error starting metrics server: {e}")
+    return tracer
+
+
+def trace_span(name, seconds, **attrs):
+    """Report an already measured span for the current session and turn"""
+    try:
+        tracer = get_tracer()
+        if tracer:
+            tracer.observe(
+                name,
+                seconds,
+                session=st.session_state.get("session_id"),
+                turn=st.session_state.get("turn", 0),
+                **attrs,
+            )
+    except Exception as e:
+        log.exception(f"Error recording span {name}: {e}")
+
+
+@contextmanager
+def trace(name, **attrs):
+    """Time the enclosed block as a span of the current session and turn.
+
+    Yields the span's attribute dict so the block can add to it. Reruns and
+    stops pass through as ok; other exceptions mark the span as an error.
+    """
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield attrs
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        trace_span(name, time.perf_counter() - started, status=status, **attrs)
+
+
+@st.cache_resource
+def get_first_page_served():
+    """Set once the first page of this server process has been drawn"""
+    return threading.Event()
+
+
+def trace_startup():
+    """Time the first page of a session, from the start of the script run until it is drawn.
+
+    The first page of the server process is reported as startup.cold, since it
+    also pays for imports and process-wide resources.
+    """
+    if st.session_state.get("script_runs") != 1:
+        return
+    served = get_first_page_served()
+    trace_span(
+        "startup" if served.is_set() else "startup.cold",
+        time.perf_counter() - SCRIPT_STARTED,
+        imports=round(IMPORTS_FINISHED - SCRIPT_STARTED, 4),
+    )
+    served.set()
+
+
 def password_entered():
     """Checks whether a password entered by the user is correct."""
     if hmac.compare_digest(st.session_state["password"], st.secrets["password"]):
         st.session_state["password_correct"] = True
         del st.session_state["password"]  # Don't store the password.
-        autoplay_audio(open("assets/unlock.mp3", "rb").read())
-        log.info(f"Session Start: {get_session()}")
+        unlock = asset_source("assets/unlock.mp3")
+        send_to_player("play", unlock if isinstance(unlock, str) else audio_source(unlock))
+        log.info("Session Start: %s", get_session())
         
         # Initialize the audio state
         if "is_speaking" not in st.session_state:
@@ -93,7 +580,7 @@ def password_entered():
             
         # Add Noa's automatic first message to welcome the student
         if len(st.session_state.messages) <= 1:  # Only system message exists
-            welcome_message = "Hi there! I'm Noa Martinez, one of the clinical instructors here at Columbia. I'll be guiding you through today's simulation. We're going to practice some change management skills in a challenging setting - implementing a flu vaccination program at a county corrections facility. You'll be meeting with Sam Richards, the Operations Manager there. He's been in his position for 14 years and, between us, he's known for being pretty resistant to change. Your goal is to persuade him to support your vaccination program despite his objections. Do you have any questions before we start, or would you like to discuss your approach?"
+            welcome_message = scripted_line("welcome")
             st.session_state.messages.append({
                 "role": "assistant", 
                 "content": welcome_message,
@@ -105,14 +592,80 @@ def password_entered():
         st.session_state["password_correct"] = False
 
 
-def load_settings():
+# Checks for the values of the [sam], [noa], [parameters] and [display] sections
+AGENT_CHECKS = {
+    "name": lambda value: isinstance(value, str) and bool(value.strip()),
+    "avatar": lambda value: isinstance(value, str) and os.path.isfile(value),
+    "voice": lambda value: value in TTS_VOICES,
+}
+PARAMETER_CHECKS = {
+    "model": lambda value: isinstance(value, str) and bool(value.strip()),
+    "temperature": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool) and 0 <= value <= 2,
+    "streaming_tts": lambda value: isinstance(value, bool),
+    "render_interval_ms": lambda value: isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= 1000,
+    "speculative_debrief": lambda value: isinstance(value, bool),
+    "worker_threads": lambda value: isinstance(value, int) and not isinstance(value, bool) and 1 <= value <= 64,
+    "tts_threads": lambda value: isinstance(value, int) and not isinstance(value, bool) and 1 <= value <= 64,
+}
+DISPLAY_CHECKS = {
+    "visible_messages": lambda value: isinstance(value, int) and not isinstance(value, bool) and value >= 1,
+}
+
+
+def validate_section(settings, name, defaults, checks):
+    """Replace missing or invalid values of a settings section with defaults and return the problems found"""
+    section = settings.get(name)
+    problems = []
+    if not isinstance(section, dict):
+        problems.append(f"[{name}] is missing")
+        section = {}
+    checked = dict(section)
+    for key, check in checks.items():
+        if key not in section:
+            problems.append(f"[{name}] {key} is missing, using {defaults[key]!r}")
+            checked[key] = defaults[key]
+        elif not check(section[key]):
+            problems.append(f"[{name}] {key} = {section[key]!r} is invalid, using {defaults[key]!r}")
+            checked[key] = defaults[key]
+    settings[name] = checked
+    return problems
+
+
+def freeze(value):
+    """Read-only copy of parsed TOML, so a snapshot shared by all sessions can't be changed by one of them"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def checked_settings(settings):
+    """Validate the agent, parameter and display sections and return a frozen snapshot"""
+    problems = []
+    for agent, defaults in DEFAULT_AGENTS.items():
+        problems += validate_section(settings, agent, defaults, AGENT_CHECKS)
+    problems += validate_section(settings, "parameters", DEFAULT_PARAMETERS, PARAMETER_CHECKS)
+    problems += validate_section(settings, "display", DEFAULT_DISPLAY, DISPLAY_CHECKS)
+    for problem in problems:
+        log.warning("settings.toml: %s", problem)
+    return freeze(settings)
+
+
+def read_settings(path="settings.toml"):
+    """Parse and validate the settings file; raises if it can't be parsed"""
+    with open(path, "rb") as f:
+        return checked_settings(tomllib.load(f))
+
+
+def load_settings(path="settings.toml"):
     """Load settings from settings.toml file"""
     try:
-        return tomllib.load(open("settings.toml", "rb"))
+        return read_settings(path)
     except Exception as e:
         log.exception(f"Error loading settings: {e}")
         # Return minimal default settings if loading fails
-        return {
+        return checked_settings({
             "title": "Columbia University School of Nursing: Implementing Flu Vaccination Program",
             "error_message": "An error occurred",
             "user_name": "Public Health Nurse",
@@ -124,10 +677,109 @@ def load_settings():
             "instruction": "You are Noa, a nursing instructor",
             "sam_instruction": "You are Sam, a corrections manager",
             "noa_instruction": "You are Noa, a nursing instructor",
-            "sam": {"name": "Sam Richards", "avatar": "assets/Sam.jpg", "voice": "onyx"},
-            "noa": {"name": "Noa Martinez", "avatar": "assets/Noa.jpg", "voice": "nova"},
-            "parameters": {"model": "gpt-4o", "temperature": 0.7}
-        }
+            "sam": dict(DEFAULT_AGENTS["sam"]),
+            "noa": dict(DEFAULT_AGENTS["noa"]),
+            "parameters": dict(DEFAULT_PARAMETERS),
+            "scripts": dict(DEFAULT_SCRIPTS),
+        })
+
+
+# Settings read once by process-wide resources (servers, pools, stores); edits take a restart
+RESTART_SETTINGS = (
+    "logging",
+    "tracing",
+    "audio_cache",
+    "audio_delivery",
+    "assets",
+    "connection_pool",
+    "rate_limits",
+    "session_store",
+    "memory",
+    ("providers", "window"),
+    ("parameters", "worker_threads"),
+    ("parameters", "tts_threads"),
+)
+
+
+def restart_settings_changed(old, new):
+    """Names of the RESTART_SETTINGS that differ between two settings snapshots"""
+    changed = []
+    for setting in RESTART_SETTINGS:
+        if isinstance(setting, str):
+            if old.get(setting) != new.get(setting):
+                changed.append(f"[{setting}]")
+        else:
+            section, key = setting
+            if old.get(section, {}).get(key) != new.get(section, {}).get(key):
+                changed.append(f"[{section}] {key}")
+    return changed
+
+
+class SettingsStore:
+    """Parses settings.toml once for all sessions and reloads it when the file changes.
+
+    Every session gets the same read-only snapshot. The file's modification time
+    is checked at most every check_interval seconds, so edits take effect without
+    a restart, except for the RESTART_SETTINGS, which are logged when they change.
+    If an edited file can't be parsed the previous snapshot is kept.
+    """
+
+    def __init__(self, path="settings.toml", check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.mtime = None
+        self.checked_at = 0.0
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def get(self):
+        if self.snapshot is not None and time.monotonic() - self.checked_at < self.check_interval:
+            return self.snapshot
+        with self.lock:
+            self.checked_at = time.monotonic()
+            mtime = self._mtime()
+            if self.snapshot is None:
+                self.snapshot, self.mtime = load_settings(self.path), mtime
+            elif mtime != self.mtime:
+                self.mtime = mtime
+                try:
+                    snapshot = read_settings(self.path)
+                    log.info("Reloaded %s", self.path)
+                    changed = restart_settings_changed(self.snapshot, snapshot)
+                    if changed:
+                        log.warning("%s changed %s, which take effect after a restart", self.path, ", ".join(changed))
+                    self.snapshot = snapshot
+                except Exception as e:
+                    log.error("%s changed but can't be parsed, keeping the previous settings: %s", self.path, e)
+            return self.snapshot
+
+
+@st.cache_resource
+def get_settings_store():
+    return SettingsStore()
+
+
+def get_settings():
+    """Current settings snapshot shared by all sessions; safe to call from worker threads"""
+    return get_settings_store().get()
+
+
+def agent_profile(agent):
+    """Validated name, avatar and voice of the "sam" or "noa" agent"""
+    return get_settings()[agent]
+
+
+def scripted_line(name, settings=None):
+    """Return the text of a scripted line from the settings, falling back to the default"""
+    if settings is None:
+        settings = get_settings()
+    return settings.get("scripts", {}).get(name, DEFAULT_SCRIPTS[name])
 
 
 @st.cache_data
@@ -160,51 +812,909 @@ def local_css(file_name):
 def speech_to_text(client, audio):
     try:
         id = audio["id"]
-        log.debug(f"STT: {id}")
+        log.debug("STT: %s", id)
         audio_bio = io.BytesIO(audio["bytes"])
         audio_bio.name = "audio.wav"
-        transcript = client.audio.transcriptions.create(
-            model="whisper-1", response_format="text", file=audio_bio
-        )
+        with trace("stt", bytes=len(audio["bytes"])):
+            transcript, seconds = timed(
+                get_api_scheduler().call,
+                "transcription",
+                "whisper-1",
+                lambda: client.audio.transcriptions.create(model="whisper-1", response_format="text", file=audio_bio),
+                api_session(),
+            )
         st.session_state.processed_audio = id
+        record_event("transcription", text=transcript, bytes=len(audio["bytes"]), seconds=round(seconds, 3))
         return transcript
     except Exception as e:
         log.exception("")
 
 
-def text_to_speech(client, text, play_immediately=True, delay_before=0, delay_after=0):
-    """Enhanced text-to-speech function with timing control"""
+def current_voice():
+    """Return the TTS voice of the agent that is currently active"""
+    if "sam_active" in st.session_state and st.session_state.sam_active:
+        return agent_profile("sam")["voice"]
+    return agent_profile("noa")["voice"]
+
+
+class AudioCache:
+    """Content-addressed TTS clip cache on disk, bounded in size with LRU eviction.
+
+    Clips are keyed by (text, voice, model) and shared by every session in the process.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> size, least recently used first
+        self.total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        files = [
+            entry for entry in os.scandir(directory)
+            if entry.is_file() and entry.name.endswith(".mp3")
+        ]
+        for entry in sorted(files, key=lambda e: e.stat().st_mtime):
+            size = entry.stat().st_size
+            self.entries[entry.name[:-4]] = size
+            self.total_bytes += size
+
+    @staticmethod
+    def key(text, voice, model):
+        return hashlib.sha256(f"{model}\0{voice}\0{text}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def get(self, text, voice, model):
+        key = self.key(text, voice, model)
+        with self.lock:
+            if key not in self.entries:
+                return None
+            try:
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+                os.utime(self._path(key))
+            except OSError:
+                self.total_bytes -= self.entries.pop(key)
+                return None
+            self.entries.move_to_end(key)
+            return data
+
+    def put(self, text, voice, model, data):
+        key = self.key(text, voice, model)
+        with self.lock:
+            if key in self.entries:
+                return
+            # Write to a temporary file first so readers never see a partial clip
+            tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+            self.entries[key] = len(data)
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                old_key, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+
+
+@st.cache_resource
+def get_audio_cache():
+    """Process-wide audio cache configured from the [audio_cache] settings"""
+    cache_settings = get_settings().get("audio_cache", {})
+    return AudioCache(
+        cache_settings.get("directory", ".audio_cache"),
+        int(cache_settings.get("max_mb", 100) * 1024 * 1024),
+    )
+
+
+class ClientRegistry:
+    """OpenAI client, and Anthropic client when there is a key, shared by every session in the process.
+
+    All requests go through one keep-alive connection pool, so chat, speech and
+    transcription calls reuse warm TLS connections instead of opening new ones
+    on every rerun.
+    """
+
+    def __init__(self, api_key, max_connections=100, max_keepalive=20, keepalive_expiry=120.0, anthropic_api_key=None):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.requests_by_path = {}
+        self.connections_opened = 0
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            event_hooks={"request": [self._count_request]},
+        )
+        # Retries are left to the API scheduler, which backs off across all sessions. The SDK sets
+        # a timeout on every request, overriding the http client's, so it is given here
+        self.openai = OpenAI(
+            api_key=api_key,
+            http_client=self.http_client,
+            max_retries=0,
+            timeout=httpx.Timeout(60.0, connect=10.0),
+        )
+        self.anthropic = None
+        if anthropic_api_key:
+            # Imported here because it takes most of a second and most deployments don't use it
+            import anthropic
+
+            # The Anthropic SDK is built on httpx2, so it keeps its own keep-alive pool
+            self.anthropic = anthropic.Anthropic(api_key=anthropic_api_key, max_retries=0)
+
+    def _count_request(self, request):
+        # httpx reports the connection events of the request to its "trace" extension
+        request.extensions["trace"] = self._trace
+        with self.lock:
+            self.requests += 1
+            path = request.url.path
+            self.requests_by_path[path] = self.requests_by_path.get(path, 0) + 1
+
+    def _trace(self, event, info):
+        if event == "connection.connect_tcp.complete":
+            with self.lock:
+                self.connections_opened += 1
+
+    def warm_up(self, connections=2):
+        """Open a few pooled connections in the background so the first turn skips the TLS handshake"""
+
+        def warm():
+            try:
+                self.openai.models.list()
+                log.info("OpenAI connection pool warmed: %s", self.stats())
+            except Exception as e:
+                log.warning("OpenAI connection warm-up failed: %s", e)
+
+        for i in range(connections):
+            threading.Thread(target=warm, name=f"openai-warmup-{i}", daemon=True).start()
+
+    def stats(self):
+        """Request and connection counts for logging; requests minus connections_opened reused a connection"""
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "requests_by_path": dict(self.requests_by_path),
+                "connections_opened": self.connections_opened,
+            }
+
+
+@st.cache_resource
+def get_client_registry():
+    """Create the process-wide OpenAI client registry and start warming its connections"""
+    pool_settings = get_settings().get("connection_pool", {})
+    registry = ClientRegistry(
+        st.secrets["OPENAI_API_KEY"],
+        max_connections=pool_settings.get("max_connections", 100),
+        max_keepalive=pool_settings.get("max_keepalive_connections", 20),
+        keepalive_expiry=pool_settings.get("keepalive_expiry", 120.0),
+        anthropic_api_key=st.secrets.get("ANTHROPIC_API_KEY"),
+    )
+    registry.warm_up(pool_settings.get("warm_connections", 2))
+    return registry
+
+
+def get_openai_client():
+    return get_client_registry().openai
+
+
+class ApiBusyError(Exception):
+    """An API call was still rate limited after all retries"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"API busy, retry in {retry_after:.0f} seconds")
+        self.retry_after = retry_after
+
+
+class FairTokenBucket:
+    """Token bucket whose waiting callers take turns by session.
+
+    Capacity refills at per_minute / 60 per second, up to burst_seconds worth,
+    which is the whole per-minute quota by default, as the providers allow.
+    Waiting requests are served round-robin across sessions, so a session that
+    queues many requests (one per sentence, say) can't get ahead of the others.
+    """
+
+    def __init__(self, per_minute, burst_seconds=60):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.cond = threading.Condition()
+        self.queues = OrderedDict()  # session -> waiting tickets; the first session is served next
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _wait_estimate(self, now, session, position, cost):
+        """Seconds until a request at this position in the session's queue is served"""
+        ahead = position + sum(min(len(queue), position + 1) for s, queue in self.queues.items() if s != session)
+        needed = (ahead + 1) * cost - self.tokens
+        return max(self.paused_until - now, needed / self.rate if needed > 0 else 0.0)
+
+    def estimate_wait(self, session, cost=1):
+        with self.cond:
+            now = time.monotonic()
+            self._refill(now)
+            position = len(self.queues.get(session, ()))
+            return self._wait_estimate(now, session, position, min(cost, self.capacity))
+
+    def pause(self, seconds):
+        """Stop serving requests for a while, e.g. after the provider returned 429"""
+        with self.cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+    def charge(self, cost):
+        """Settle the difference between a request's actual cost and what it acquired; negative refunds"""
+        with self.cond:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens - cost)
+            self.cond.notify_all()
+
+    def acquire(self, session, cost=1, on_wait=None):
+        """Wait for this session's turn and cost tokens; calls on_wait(seconds) about once a second while waiting"""
+        cost = min(cost, self.capacity)
+        ticket = object()
+        reported_at = 0.0
+        with self.cond:
+            queue = self.queues.setdefault(session, deque())
+            queue.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if (
+                        next(iter(self.queues)) == session
+                        and queue[0] is ticket
+                        and self.tokens >= cost
+                        and now >= self.paused_until
+                    ):
+                        self.tokens -= cost
+                        return
+                    estimate = self._wait_estimate(now, session, queue.index(ticket), cost)
+                    if on_wait and now - reported_at >= 1.0:
+                        on_wait(estimate)
+                        reported_at = now
+                    self.cond.wait(timeout=min(max(estimate, 0.05), 1.0))
+            finally:
+                queue.remove(ticket)
+                if queue:
+                    self.queues.move_to_end(session)  # the other sessions go first
+                else:
+                    del self.queues[session]
+                self.cond.notify_all()
+
+
+class ApiScheduler:
+    """Process-wide admission control for OpenAI and Anthropic calls.
+
+    Every endpoint and model has its own requests-per-minute bucket, and a
+    tokens-per-minute bucket when a tpm limit is set, shared by all sessions.
+    Rate-limit and transient errors are retried with exponential backoff and
+    random jitter, so a class that starts at the same moment doesn't retry in
+    lockstep. A 429 pauses the bucket for all sessions, not just the caller.
+    """
+
+    @staticmethod
+    def provider_errors():
+        """Rate-limit errors and all retryable errors of the provider SDKs.
+
+        The Anthropic SDK is only imported with the first Anthropic client, and
+        until then none of its errors can be raised.
+        """
+        rate_limited = (openai.RateLimitError,)
+        retryable = (openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+        anthropic = sys.modules.get("anthropic")
+        if anthropic:
+            rate_limited += (anthropic.RateLimitError,)
+            retryable += (
+                anthropic.APIConnectionError,
+                anthropic.APITimeoutError,
+                anthropic.InternalServerError,
+                anthropic.OverloadedError,
+            )
+        return rate_limited, rate_limited + retryable
+
+    def __init__(self, limits, max_retries=4, backoff=1.0):
+        self.limits = limits
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.buckets = {}  # (endpoint, model) -> {"rpm": bucket, "tpm": bucket}
+
+    def _buckets(self, endpoint, model):
+        with self.lock:
+            if (endpoint, model) not in self.buckets:
+                limits = {**self.limits.get(endpoint, {}), **self.limits.get("models", {}).get(model, {})}
+                self.buckets[(endpoint, model)] = {
+                    kind: FairTokenBucket(limits[kind]) for kind in ("rpm", "tpm") if limits.get(kind)
+                }
+            return self.buckets[(endpoint, model)]
+
+    def estimate_wait(self, endpoint, model, session, tokens=0):
+        """Seconds a new request from this session would wait before it is sent"""
+        buckets = self._buckets(endpoint, model)
+        return max(
+            [bucket.estimate_wait(session, tokens if kind == "tpm" else 1) for kind, bucket in buckets.items()],
+            default=0.0,
+        )
+
+    def charge(self, endpoint, model, tokens):
+        """Charge tokens used beyond those acquired for a call, such as the reply's, once they are known"""
+        bucket = self._buckets(endpoint, model).get("tpm")
+        if bucket and tokens:
+            bucket.charge(tokens)
+
+    def call(self, endpoint, model, request, session, tokens=0, on_wait=None):
+        """Send request() once the limits allow, retrying rate limits and transient errors.
+
+        tokens is the prompt estimate acquired up front; charge() settles the
+        actual usage after the call.
+
+        Raises ApiBusyError when the provider is still rate limiting after max_retries.
+        """
+        buckets = self._buckets(endpoint, model)
+        rate_limited, retryable = self.provider_errors()
+        for attempt in range(self.max_retries + 1):
+            for kind, bucket in buckets.items():
+                bucket.acquire(session, tokens if kind == "tpm" else 1, on_wait)
+            try:
+                return request()
+            except retryable as e:
+                if getattr(e, "code", None) == "insufficient_quota":
+                    raise
+                delay = self.backoff * 2**attempt * random.uniform(0.5, 1.5)
+                if isinstance(e, rate_limited):
+                    try:
+                        delay = max(delay, float(e.response.headers.get("retry-after", 0)))
+                    except ValueError:
+                        pass
+                    for bucket in buckets.values():
+                        bucket.pause(delay)
+                if attempt == self.max_retries:
+                    if isinstance(e, rate_limited):
+                        raise ApiBusyError(delay) from e
+                    raise
+                log.warning("%s %s failed (%s), retry %s in %.1f s", endpoint, model, e, attempt + 1, delay)
+                if on_wait:
+                    on_wait(delay)
+                time.sleep(delay)
+
+
+@st.cache_resource
+def get_api_scheduler():
+    limits = get_settings().get("rate_limits", {})
+    return ApiScheduler(limits, limits.get("max_retries", 4), limits.get("backoff_seconds", 1.0))
+
+
+def api_session():
+    """Key the scheduler uses to take turns between sessions: the session id on a script thread"""
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return "background"
+    return st.session_state.get("session_id", "background")
+
+
+def chat_request_key(messages):
+    """Key by which tools/replay.py matches a recorded reply to its request: the instruction and the last message"""
+    key = json.dumps([messages[0]["content"], messages[-1]["content"]])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def prompt_cache_key(messages):
+    """Cache routing key shared by all requests that start with the same instruction"""
+    return "persona-" + hashlib.sha256(messages[0]["content"].encode("utf-8")).hexdigest()[:16]
+
+
+class ChatProvider:
+    """Streaming chat replies from one API.
+
+    open sends the request and returns the response stream; events turns that
+    stream into ("text", chunk) and ("usage", usage) pairs, where usage holds
+    prompt_tokens and the cached_tokens among them. Messages use the OpenAI
+    format, with the instruction and summary as system messages.
+    """
+
+    name = None
+
+    def __init__(self, client):
+        self.client = client
+
+    def open(self, model, messages, temperature, max_tokens):
+        raise NotImplementedError
+
+    def events(self, stream):
+        raise NotImplementedError
+
+
+class OpenAIChatProvider(ChatProvider):
+    name = "openai"
+
+    def open(self, model, messages, temperature, max_tokens):
+        # Prefixes of 1024+ tokens are cached automatically; the key sends requests
+        # with the same persona to the same cache
+        return self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+            max_tokens=max_tokens,
+            prompt_cache_key=prompt_cache_key(messages),
+        )
+
+    def events(self, stream):
+        for chunk in stream:
+            if chunk.usage is not None:
+                details = chunk.usage.prompt_tokens_details
+                yield "usage", {
+                    "prompt_tokens": chunk.usage.prompt_tokens,
+                    "cached_tokens": (details.cached_tokens or 0) if details else 0,
+                }
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield "text", chunk.choices[0].delta.content
+
+
+class AnthropicChatProvider(ChatProvider):
+    name = "anthropic"
+
+    def open(self, model, messages, temperature, max_tokens):
+        # System messages go in the system parameter, and turns must alternate starting with the student.
+        # The Messages API takes no temperature, so the model's default sampling is used
+        system = [{"type": "text", "text": m["content"]} for m in messages if m["role"] == "system"]
+        turns = []
+        for m in messages:
+            if m["role"] == "system":
+                continue
+            if turns and turns[-1]["role"] == m["role"]:
+                turns[-1]["content"] += "\n\n" + m["content"]
+            else:
+                turns.append({"role": m["role"], "content": m["content"]})
+        if not turns or turns[0]["role"] != "user":
+            turns.insert(0, {"role": "user", "content": "(The conversation begins.)"})
+        # Caching is explicit: one breakpoint after the instruction, shared by every session with
+        # this persona, and one after the latest turn, which the next turn of this session reads
+        if system:
+            system[0]["cache_control"] = {"type": "ephemeral"}
+        turns[-1] = {
+            "role": turns[-1]["role"],
+            "content": [{"type": "text", "text": turns[-1]["content"], "cache_control": {"type": "ephemeral"}}],
+        }
+        return self.client.messages.create(
+            model=model,
+            system=system,
+            messages=turns,
+            max_tokens=max_tokens,
+            stream=True,
+        )
+
+    def events(self, stream):
+        for event in stream:
+            if event.type == "message_start":
+                usage = event.message.usage
+                cached = usage.cache_read_input_tokens or 0
+                written = usage.cache_creation_input_tokens or 0
+                yield "usage", {
+                    "prompt_tokens": usage.input_tokens + cached + written,
+                    "cached_tokens": cached,
+                    "cache_write_tokens": written,
+                }
+            elif event.type == "content_block_delta" and event.delta.type == "text_delta":
+                yield "text", event.delta.text
+
+
+class ChatAttempt:
+    """One provider's request for a turn, streamed into the turn's event queue by a background thread"""
+
+    def __init__(self, provider, model, events):
+        self.provider = provider
+        self.model = model
+        self.events = events
+        self.cancelled = threading.Event()
+        self.started = time.time()
+        self.admitted_at = None
+        self.first_token_at = None
+        self.usage = None
+
+    def cancel(self):
+        """Stop the request at its next chunk, or before it is sent if it is still queued"""
+        self.cancelled.set()
+
+    def _send(self, request):
+        if self.cancelled.is_set():
+            return None
+        self.admitted_at = time.time()
+        return self.provider.open(self.model, **request)
+
+    def run(self, request, session, tokens):
+        scheduler = get_api_scheduler()
+        try:
+            stream = scheduler.call(
+                "chat",
+                self.model,
+                lambda: self._send(request),
+                session,
+                tokens=tokens,
+                on_wait=lambda seconds: self.events.put((self, "wait", seconds)),
+            )
+            if stream is None:
+                self.events.put((self, "done", None))
+                return
+            reply_tokens = 0
+            try:
+                for kind, value in self.provider.events(stream):
+                    if self.cancelled.is_set():
+                        break
+                    if kind == "usage":
+                        self.usage = value
+                        continue
+                    if self.first_token_at is None:
+                        self.first_token_at = time.time()
+                    reply_tokens += len(value) / 4  # as estimate_tokens counts
+                    self.events.put((self, "text", value))
+            finally:
+                stream.close()
+                prompt_tokens = self.usage["prompt_tokens"] if self.usage else tokens
+                scheduler.charge("chat", self.model, prompt_tokens - tokens + reply_tokens)
+            self.events.put((self, "done", None))
+        except Exception as e:
+            self.events.put((self, "error", e))
+
+
+class ChatTurn:
+    """A reply streamed through the router: iterate it for ("text", chunk) and ("usage", usage).
+
+    The first provider's request runs on a background thread. If no token has
+    arrived by the hedge deadline, a backup request goes to the next provider,
+    and the reply is streamed from whichever answers first; the other request
+    is cancelled. A request that fails before answering moves the turn to the
+    next provider straight away.
+    """
+
+    def __init__(self, router, routes, options, request, session, tokens, on_wait):
+        self.router = router
+        self.candidates = router.rank(routes)
+        self.options = options
+        self.request = request
+        self.session = session
+        self.tokens = tokens
+        self.on_wait = on_wait
+        self.events = queue.Queue()
+        self.attempts = []
+        self.live = set()
+        self.winner = None
+        self.hedged = False
+        self.started = time.time()
+
+    def _start(self):
+        name, model = self.candidates.pop(0)
+        attempt = ChatAttempt(self.router.providers[name], model, self.events)
+        self.attempts.append(attempt)
+        self.live.add(attempt)
+        threading.Thread(
+            target=attempt.run, args=(self.request, self.session, self.tokens), name=f"chat-{name}", daemon=True
+        ).start()
+        if self.options.get("hedge", True) and self.candidates:
+            return time.monotonic() + self.router.hedge_deadline(name, self.options)
+        return None
+
+    def __iter__(self):
+        deadline = self._start()
+        try:
+            while True:
+                try:
+                    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                    attempt, kind, value = self.events.get(timeout=timeout)
+                except queue.Empty:
+                    log.info(
+                        "No first token from %s after %.1f s, hedging with %s",
+                        self.attempts[-1].provider.name,
+                        time.time() - self.started,
+                        self.candidates[0][0],
+                    )
+                    self.hedged = True
+                    deadline = self._start()
+                    continue
+                if self.winner is not None and attempt is not self.winner:
+                    continue
+                if kind == "wait":
+                    if self.on_wait:
+                        self.on_wait(value)
+                elif kind == "text":
+                    if self.winner is None:
+                        self._choose(attempt)
+                        deadline = None  # the reply is streaming, no backup needed
+                    yield "text", value
+                elif kind == "done":
+                    if self.winner is None:
+                        self._choose(attempt)
+                    if attempt.usage is not None:
+                        yield "usage", attempt.usage
+                    return
+                elif kind == "error":
+                    self.router.record_failure(
+                        attempt.provider.name, value, self.options.get("failure_cooldown_seconds", 60.0)
+                    )
+                    self.live.discard(attempt)
+                    if attempt is self.winner or (not self.live and not self.candidates):
+                        raise value
+                    if not self.live:
+                        log.warning("%s failed (%s), moving the turn to %s", attempt.provider.name, value, self.candidates[0][0])
+                        deadline = self._start()
+        finally:
+            for attempt in self.attempts:
+                attempt.cancel()
+
+    def _choose(self, attempt):
+        self.winner = attempt
+        if attempt.first_token_at is not None:
+            self.router.record_ttft(attempt.provider.name, attempt.first_token_at - attempt.admitted_at)
+        for other in self.attempts:
+            if other is not attempt:
+                other.cancel()
+
+
+class ChatRouter:
+    """Sends each turn to the healthy chat provider with the fastest recent time to first token.
+
+    Time to first token is measured from when the request is sent, so time
+    spent queued under the rate limits doesn't count against a provider.
+    Providers without samples keep their configured order. The hedge deadline
+    is the provider's p95 time to first token times hedge_multiplier, kept
+    between hedge_min_seconds and hedge_max_seconds, and is hedge_max_seconds
+    until there are enough samples. A provider that fails is skipped for
+    failure_cooldown_seconds unless no other provider is left.
+    """
+
+    MIN_SAMPLES = 5
+
+    def __init__(self, providers, window=50):
+        self.providers = providers  # name -> ChatProvider
+        self.lock = threading.Lock()
+        self.ttft = {name: deque(maxlen=window) for name in providers}
+        self.failures = {name: 0 for name in providers}
+        self.unhealthy_until = {name: 0.0 for name in providers}
+
+    def routes(self, settings):
+        """(provider, model) pairs of the configured providers this server has a client for"""
+        config = settings.get("providers", {})
+        models = {
+            "openai": settings["parameters"]["model"],
+            "anthropic": config.get("anthropic_model", DEFAULT_ANTHROPIC_MODEL),
+        }
+        return [(name, models[name]) for name in config.get("order", ["openai"]) if name in self.providers]
+
+    def rank(self, routes):
+        """Routes in the order to try them: healthy first, then by median time to first token"""
+        now = time.monotonic()
+        with self.lock:
+            keys = {
+                name: (self.unhealthy_until[name] > now, percentile(samples, 0.50) if samples else float("inf"))
+                for name, samples in self.ttft.items()
+            }
+        return sorted(routes, key=lambda route: keys[route[0]])
+
+    def hedge_deadline(self, name, options):
+        """Seconds to wait for the first token from this provider before hedging"""
+        low, high = options.get("hedge_min_seconds", 1.0), options.get("hedge_max_seconds", 6.0)
+        with self.lock:
+            samples = list(self.ttft[name])
+        if len(samples) < self.MIN_SAMPLES:
+            return high
+        return min(high, max(low, percentile(samples, 0.95) * options.get("hedge_multiplier", 1.2)))
+
+    def record_ttft(self, name, seconds):
+        with self.lock:
+            self.ttft[name].append(seconds)
+            self.failures[name] = 0
+
+    def record_failure(self, name, error, cooldown=60.0):
+        log.warning("Chat provider %s failed: %s", name, error)
+        with self.lock:
+            self.failures[name] += 1
+            self.unhealthy_until[name] = time.monotonic() + cooldown
+
+    def stream(self, routes, options, messages, temperature, max_tokens, session, tokens=0, on_wait=None):
+        """Start a turn; on_wait(seconds) is called while the request waits for its turn under the rate limits"""
+        request = {"messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+        return ChatTurn(self, routes, options, request, session, tokens, on_wait)
+
+    def stats(self):
+        """Recent time to first token and health of each provider, for the admin page"""
+        now = time.monotonic()
+        with self.lock:
+            return [
+                {
+                    "provider": name,
+                    "samples": len(samples),
+                    "ttft_p50": round(percentile(samples, 0.50), 3) if samples else None,
+                    "ttft_p95": round(percentile(samples, 0.95), 3) if samples else None,
+                    "failures": self.failures[name],
+                    "healthy": self.unhealthy_until[name] <= now,
+                }
+                for name, samples in self.ttft.items()
+            ]
+
+
+@st.cache_resource
+def get_chat_router():
+    """Chat providers this server has API keys for, behind one process-wide router"""
+    registry = get_client_registry()
+    providers = {"openai": OpenAIChatProvider(registry.openai)}
+    if registry.anthropic:
+        providers["anthropic"] = AnthropicChatProvider(registry.anthropic)
+    else:
+        log.info("No ANTHROPIC_API_KEY in the app secrets, chat replies use OpenAI only")
+    return ChatRouter(providers, get_settings().get("providers", {}).get("window", 50))
+
+
+def synthesize_speech(client, text, voice, cache=False, session=None):
+    """Call the TTS endpoint and return the MP3 bytes.
+
+    With cache=True the clip is served from and stored in the shared audio cache.
+    Does not touch st.session_state, so it is safe to run on a worker thread
+    when the session is passed in.
+    """
+    audio_cache = get_audio_cache() if cache else None
+    if audio_cache:
+        data = audio_cache.get(text, voice, TTS_MODEL)
+        if data is not None:
+            return data
+    response = get_api_scheduler().call(
+        "speech",
+        TTS_MODEL,
+        lambda: client.audio.speech.create(model=TTS_MODEL, voice=voice, input=text),
+        session or api_session(),
+    )
+    if audio_cache:
+        audio_cache.put(text, voice, TTS_MODEL, response.content)
+    return response.content
+
+
+@st.cache_resource
+def warm_audio_cache():
+    """Synthesize the scripted lines into the audio cache once per server process"""
+
+    def warm():
+        try:
+            settings = get_settings()
+            client = get_openai_client()
+            for name, agent in SCRIPT_AGENTS.items():
+                synthesize_speech(client, scripted_line(name, settings), settings[agent]["voice"], cache=True)
+            log.info("Audio cache warmed with scripted lines")
+        except Exception as e:
+            log.exception(f"Error warming audio cache: {e}")
+
+    thread = threading.Thread(target=warm, name="audio-cache-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+@st.cache_resource
+def get_worker_pool():
+    """Worker pool shared by all sessions for background work: summaries and speech segment transcription"""
+    return ThreadPoolExecutor(max_workers=get_settings()["parameters"]["worker_threads"], thread_name_prefix="worker")
+
+
+@st.cache_resource
+def get_tts_pool():
+    """Pool for sentence speech synthesis, kept apart so slow background work can't delay the next sentence"""
+    return ThreadPoolExecutor(max_workers=get_settings()["parameters"]["tts_threads"], thread_name_prefix="tts")
+
+
+# A sentence ends at . ! or ? (optionally followed by closing quotes or brackets) and whitespace
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])[\"')\]]*\s+")
+
+
+def pop_sentences(buffer, min_chars=20):
+    """Split the complete sentences off the front of a streaming text buffer.
+
+    Sentences shorter than min_chars are merged with the following one so that
+    fragments like "Look." are not synthesized as separate clips.
+    Returns the list of sentences and the incomplete remainder.
+    """
+    sentences = []
+    start = 0
+    for match in SENTENCE_BOUNDARY.finditer(buffer):
+        sentence = buffer[start:match.end()].strip()
+        if len(sentence) >= min_chars:
+            sentences.append(sentence)
+            start = match.end()
+    return sentences, buffer[start:]
+
+
+class SpeechPipeline:
+    """Speaks a streaming reply sentence by sentence while the LLM is still generating.
+
+    Each complete sentence is sent to the TTS endpoint on the TTS pool as soon as
+    it is available. Finished clips are handed to the browser playback queue
+    strictly in sentence order.
+    """
+
+    def __init__(self, client, voice):
+        self.client = client
+        self.voice = voice
+        self.buffer = ""
+        self.pending = deque()
+        self.executor = get_tts_pool()
+        self.session = api_session()
+
+    def _submit(self, sentence):
+        log.debug("TTS sentence: %s", sentence)
+        self.pending.append(
+            (sentence, self.executor.submit(timed, synthesize_speech, self.client, sentence, self.voice, session=self.session))
+        )
+
+    def feed(self, chunk):
+        """Add streamed text and start synthesis for any sentence it completes"""
+        self.buffer += chunk
+        sentences, self.buffer = pop_sentences(self.buffer)
+        for sentence in sentences:
+            self._submit(sentence)
+        self.play_ready()
+
+    def play_ready(self, wait=False):
+        """Queue finished clips for playback, keeping sentence order.
+
+        With wait=True every remaining clip is played. Clips already being
+        synthesized are waited for; clips still queued behind other sessions'
+        work are taken back and synthesized on this thread instead.
+        """
+        while self.pending and (wait or self.pending[0][1].done()):
+            sentence, future = self.pending.popleft()
+            try:
+                if wait and future.cancel():
+                    audio_content, seconds = timed(
+                        synthesize_speech, self.client, sentence, self.voice, session=self.session
+                    )
+                else:
+                    audio_content, seconds = future.result()
+                record_event("speech", text=sentence, bytes=len(audio_content), seconds=round(seconds, 3))
+                trace_span("tts.sentence", seconds, chars=len(sentence), bytes=len(audio_content))
+                autoplay_audio(audio_content, queued=True)
+            except Exception as e:
+                log.exception(f"Error in sentence text_to_speech: {e}")
+
+    def close(self):
+        """Synthesize the trailing text and play every remaining clip"""
+        if self.buffer.strip():
+            self._submit(self.buffer.strip())
+        self.buffer = ""
+        self.play_ready(wait=True)
+
+
+def text_to_speech(client, text, play_immediately=True, cache=False, clip_id=None, queued=False):
+    """Synthesize text in the active agent's voice and optionally play it
+
+    Pass cache=True for scripted lines so they are served from the shared audio cache.
+    Sequencing after playback is event driven: pass a clip_id to have the browser
+    report through the audio player when the clip has finished playing.
+    Pass queued=True to play it after the clips already playing instead of over them.
+    """
     try:
-        # Add optional delay before speaking (for sequencing)
-        if delay_before > 0:
-            time.sleep(delay_before)
-            
         # Set speaking state to true - this lets us know audio is playing
         st.session_state.is_speaking = True
         
-        log.debug(f"TTS: {text}")
+        log.debug("TTS: %s", text)
         # Use the appropriate voice based on the current active agent
-        if "sam_active" in st.session_state and st.session_state.sam_active:
-            current_voice = "onyx"  # Sam's voice
-        else:
-            current_voice = "nova"  # Noa's voice
-        
-        response = client.audio.speech.create(
-            model="tts-1",
-            voice=current_voice,
-            input=text,
-        )
+        with trace("tts", chars=len(text), cached=cache):
+            audio_content, seconds = timed(synthesize_speech, client, text, current_voice(), cache=cache)
+        record_event("speech", text=text, bytes=len(audio_content), seconds=round(seconds, 3))
         
         # Play the audio if requested
         if play_immediately:
-            autoplay_audio(response.content)
-            
-            # Add optional delay after speaking (for sequencing)
-            if delay_after > 0:
-                time.sleep(delay_after)
+            autoplay_audio(audio_content, queued=queued, clip_id=clip_id)
             
         # Return the audio content for later use
-        return response.content
+        return audio_content
         
     except Exception as e:
         log.exception(f"Error in text_to_speech: {e}")
@@ -222,9 +1732,9 @@ def play_welcome_audio():
             # Get the welcome message
             welcome_message = st.session_state.messages[1]["content"]
             
-            # Play the audio
-            speech_client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-            text_to_speech(speech_client, welcome_message)
+            # Play the audio after the unlock sound from the same run
+            speech_client = get_openai_client()
+            text_to_speech(speech_client, welcome_message, cache=True, queued=True)
             
             # Mark as played
             st.session_state.welcome_audio_needs_playing = False
@@ -232,141 +1742,632 @@ def play_welcome_audio():
             log.exception(f"Error playing welcome audio: {e}")
 
 
-def autoplay_audio(audio_data):
-    """Play audio with a unique ID to prevent conflicts"""
+class AudioClipStore:
+    """Short-lived in-memory store of synthesized clips, addressed by short random ids.
+
+    Clips expire after ttl seconds; the oldest clips are dropped first when the
+    store grows beyond max_bytes.
+    """
+
+    def __init__(self, ttl, max_bytes):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.clips = OrderedDict()  # id -> (data, expires_at), oldest first
+        self.total_bytes = 0
+
+    def _drop(self, clip_id):
+        data, _ = self.clips.pop(clip_id)
+        self.total_bytes -= len(data)
+
+    def purge(self):
+        """Remove expired clips and trim the store to its size limit"""
+        now = time.time()
+        with self.lock:
+            for clip_id in [i for i, (_, expires_at) in self.clips.items() if expires_at <= now]:
+                self._drop(clip_id)
+            while self.total_bytes > self.max_bytes and self.clips:
+                self._drop(next(iter(self.clips)))
+
+    def put(self, data):
+        clip_id = secrets.token_urlsafe(6)
+        with self.lock:
+            self.clips[clip_id] = (data, time.time() + self.ttl)
+            self.total_bytes += len(data)
+        self.purge()
+        return clip_id
+
+    def get(self, clip_id):
+        with self.lock:
+            clip = self.clips.get(clip_id)
+        if clip is None or clip[1] <= time.time():
+            return None
+        return clip[0]
+
+
+@st.cache_resource
+def get_audio_clip_store():
+    """Process-wide store of recent clips, or None when clips are sent inline"""
+    delivery = get_settings().get("audio_delivery", {})
+    if delivery.get("mode", "media") != "media" or not runtime_exists():
+        return None
+    return AudioClipStore(delivery.get("ttl", 600), int(delivery.get("max_mb", 200) * 1024 * 1024))
+
+
+def register_clip(clip_id, data):
+    """Serve a clip through Streamlit's media file manager for this session and return its /media/ URL"""
+    return get_instance().media_file_mgr.add(data, "audio/mpeg", f"audio-clip-{clip_id}")
+
+
+def keep_clips():
+    """Register this session's unexpired clips again for this run.
+
+    Streamlit drops the media files a session didn't register in its latest
+    run, but a queued clip may only be fetched by the player a few runs after
+    it was sent.
+    """
+    store = get_audio_clip_store()
+    if not store or not st.session_state.get("clips"):
+        return
+    live = []
+    for clip_id in st.session_state.clips:
+        data = store.get(clip_id)
+        if data is not None:
+            register_clip(clip_id, data)
+            live.append(clip_id)
+    st.session_state.clips = live
+
+
+def audio_source(audio_data):
+    """Return a same-origin /media/ URL for the clip, or a base64 data URI when clips are sent inline"""
     try:
-        # Generate a unique ID for this audio element to prevent caching issues
-        audio_id = f"audio_{get_uuid()}"
-        b64 = base64.b64encode(audio_data).decode("utf-8")
-        
-        # Create the HTML for the audio element only
-        md = f"""
-        <audio id="{audio_id}" autoplay>
-        <source src="data:audio/mp3;base64,{b64}" type="audio/mp3">
-        </audio>
-        """
-        st.markdown(md, unsafe_allow_html=True)
-        
-        # Add the script separately using components.html to avoid it being displayed
-        # The script will be hidden (height=0)
-        st.components.v1.html(
-            f"""
-            <script>
-                const audio = document.getElementById('{audio_id}');
-                if (audio) {{
-                    console.log('Audio element found and initialized');
-                }}
-            </script>
-            """, 
-            height=0
+        store = get_audio_clip_store()
+        if store:
+            clip_id = store.put(audio_data)
+            url = register_clip(clip_id, audio_data)
+            st.session_state.clips = st.session_state.get("clips", []) + [clip_id]
+            return url
+    except Exception as e:
+        log.exception(f"Error registering audio clip: {e}")
+    b64 = base64.b64encode(audio_data).decode("utf-8")
+    return f"data:audio/mp3;base64,{b64}"
+
+
+class AssetRegistry:
+    """Images and sounds from assets/, loaded once per process.
+
+    Images are scaled down to fit image_size pixels and re-encoded, so a
+    multi-megabyte photo costs the page a few dozen kilobytes.
+    """
+
+    IMAGE_TYPES = (".jpg", ".jpeg", ".png")
+
+    def __init__(self, image_size):
+        self.image_size = image_size
+        self.lock = threading.Lock()
+        self.by_path = {}  # path -> prepared data
+
+    def load(self, path):
+        """The prepared data of the asset"""
+        with self.lock:
+            data = self.by_path.get(path)
+        if data is None:
+            data = self._prepare(path)
+            with self.lock:
+                self.by_path[path] = data
+        return data
+
+    def _prepare(self, path):
+        started = time.perf_counter()
+        with open(path, "rb") as f:
+            original = f.read()
+        ext = os.path.splitext(path)[1].lower()
+        data = self._shrink(original, ext) if ext in self.IMAGE_TYPES else original
+        log.info(
+            "Asset %s: %s bytes, %s served (%.3f s)", path, len(original), len(data), time.perf_counter() - started
+        )
+        return data
+
+    def _shrink(self, data, ext):
+        from PIL import Image, ImageOps
+
+        image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+        image.thumbnail((self.image_size, self.image_size))
+        buffer = BytesIO()
+        if ext == ".png":
+            image.save(buffer, "PNG", optimize=True)
+        else:
+            image.convert("RGB").save(buffer, "JPEG", quality=85, optimize=True, progressive=True)
+        return min(buffer.getvalue(), data, key=len)
+
+
+@st.cache_resource
+def get_assets():
+    return AssetRegistry(get_settings().get("assets", {}).get("image_size", 512))
+
+
+def asset_source(path):
+    """The prepared data of the asset for Streamlit to serve, or its path if it can't be loaded"""
+    try:
+        return get_assets().load(path)
+    except Exception as e:
+        log.exception(f"Error loading asset {path}: {e}")
+        return path
+
+
+def send_to_player(mode, src="", clip_id=None):
+    """Hand a clip or a stop request to the audio player as a hidden marker in the page"""
+    notify = f' data-notify="{clip_id}"' if clip_id else ""
+    st.markdown(
+        f'<div class="sim-clip" hidden data-clip-id="{uuid.uuid4().hex}" data-mode="{mode}" data-src="{src}"{notify}></div>',
+        unsafe_allow_html=True,
+    )
+
+
+def autoplay_audio(audio_data, queued=False, clip_id=None):
+    """Play a clip through the session's audio player
+
+    With queued=True the clip waits until the previously queued clips have
+    finished, so sentence clips play in order without gaps. Otherwise it
+    replaces whatever is playing. With a clip_id the player reports the end of
+    playback back to the server.
+    """
+    try:
+        started = time.perf_counter()
+        src = audio_source(audio_data)
+        send_to_player("queue" if queued else "play", src, clip_id)
+        trace_span(
+            "deliver", time.perf_counter() - started, bytes=len(audio_data), inline=src.startswith("data:"), queued=queued
         )
-        
         return True
     except Exception as e:
         log.exception(f"Error in autoplay_audio: {e}")
         return False
 
 
-# Send prompt to OpenAI and get response
-def stream_response_openai(client, messages):
+def estimate_tokens(text):
+    """Rough token count for budgeting (about four characters per token)"""
+    return len(text) // 4 + 4
+
+
+class ConversationContext:
+    """Keeps the prompt of every turn within a token budget.
+
+    The persona instruction and the most recent turns are sent verbatim. Older
+    turns are folded into a running summary that is updated in the background
+    after each reply, so long sessions and debriefs don't send the whole
+    history every turn. Turns the summary hasn't caught up with yet are still
+    sent verbatim, so nothing is dropped.
+    """
+
+    SUMMARY_PROMPT = (
+        "You maintain a running summary of a nursing education simulation. The student, a public "
+        "health nurse, first prepares with instructor Noa Martinez, then tries to convince Sam Richards, "
+        "a resistant corrections operations manager, to support a flu vaccination program, then gets "
+        "feedback from Noa. Update the summary with the new turns. Keep the concerns Sam raised, the "
+        "arguments, strategies and concrete proposals the student used, how Sam reacted, and any "
+        "commitments made, since Noa's feedback depends on them. Reply with the updated summary only."
+    )
+
+    def __init__(self, max_prompt_tokens=6000, keep_turns=8, summary_model="gpt-4o-mini"):
+        self.max_prompt_tokens = max_prompt_tokens
+        self.keep_turns = keep_turns
+        self.summary_model = summary_model
+        self.lock = threading.Lock()
+        self.summary = ""
+        self.summarized_upto = 1  # messages[1:summarized_upto] are covered by the summary
+        self.summary_future = None
+        self.turn_stats = []  # one entry per request: estimated and actual prompt tokens
+
+    def _window_start(self, instruction, messages):
+        """Index of the first message that is sent verbatim.
+
+        The start moves in steps of keep_turns messages, so the front of
+        the prompt (instruction, summary and the oldest verbatim turns) stays
+        byte-identical for several turns in a row and the providers' prompt
+        caches can reuse it.
+        """
+        budget = self.max_prompt_tokens - estimate_tokens(instruction) - estimate_tokens(self.summary)
+        start = len(messages)
+        while start > 1 and len(messages) - start < self.keep_turns * 2:
+            cost = estimate_tokens(messages[start - 1]["content"])
+            # Always keep the latest message, even if it alone exceeds the budget
+            if start < len(messages) and cost > budget:
+                break
+            budget -= cost
+            start -= 1
+        # Start earlier, on the last step boundary, if the extra turns fit in what is left of the budget
+        step = max(1, self.keep_turns)
+        aligned = 1 + (start - 1) // step * step
+        extra = sum(estimate_tokens(m["content"]) for m in messages[aligned:start])
+        return aligned if extra <= budget else start
+
+    def build(self, instruction, messages, record=True):
+        """Return the messages to send for this turn: instruction, summary and recent turns.
+
+        With record=False the request isn't added to the per-turn prompt statistics.
+        """
+        start = self._window_start(instruction, messages)
+        with self.lock:
+            summary, summarized_upto = self.summary, self.summarized_upto
+        # Turns that fell out of the window but are not summarized yet are sent as they are
+        start = min(start, summarized_upto)
+        prompt = [{"role": "system", "content": instruction}]
+        if summary and start > 1:
+            prompt.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+        prompt += [{"role": m["role"], "content": m["content"]} for m in messages[start:]]
+        if not record:
+            return prompt
+
+        self.turn_stats.append({
+            "turn": len(self.turn_stats) + 1,
+            "estimated_prompt_tokens": sum(estimate_tokens(m["content"]) for m in prompt),
+            "full_history_tokens": estimate_tokens(instruction)
+                + sum(estimate_tokens(m["content"]) for m in messages[1:]),
+            "verbatim_messages": len(messages) - start,
+            "prompt_tokens": None,
+            "cached_tokens": None,
+        })
+        return prompt
+
+    def record_usage(self, usage):
+        """Store the prompt and cached token counts the API reported for the latest request"""
+        if self.turn_stats and usage is not None:
+            self.turn_stats[-1]["prompt_tokens"] = usage["prompt_tokens"]
+            self.turn_stats[-1]["cached_tokens"] = usage["cached_tokens"]
+            log.info("Prompt tokens: %s", self.turn_stats[-1])
+
+    def refresh_summary(self, client, instruction, messages):
+        """Fold the turns that fell out of the window into the summary on a worker thread"""
+        start = self._window_start(instruction, messages)
+        with self.lock:
+            if start <= self.summarized_upto or (self.summary_future and not self.summary_future.done()):
+                return
+            new_turns = [dict(m) for m in messages[self.summarized_upto:start]]
+            self.summary_future = get_worker_pool().submit(self._summarize, client, new_turns, start, api_session())
+
+    def _summarize(self, client, new_turns, upto, session):
+        transcript = "\n".join(
+            f"{'Student' if m['role'] == 'user' else agent_profile(m.get('agent', 'noa'))['name']}: {m['content']}"
+            for m in new_turns
+        )
+        prompt = f"Current summary:\n{self.summary or '(none)'}\n\nNew turns:\n{transcript}"
+        prompt_tokens = estimate_tokens(self.SUMMARY_PROMPT + prompt)
+        try:
+            response = get_api_scheduler().call(
+                "chat",
+                self.summary_model,
+                lambda: client.chat.completions.create(
+                    model=self.summary_model,
+                    messages=[
+                        {"role": "system", "content": self.SUMMARY_PROMPT},
+                        {"role": "user", "content": prompt},
+                    ],
+                    temperature=0.2,
+                    max_tokens=600,
+                ),
+                session,
+                tokens=prompt_tokens,
+            )
+            if response.usage:
+                get_api_scheduler().charge("chat", self.summary_model, response.usage.total_tokens - prompt_tokens)
+            with self.lock:
+                self.summary = response.choices[0].message.content.strip()
+                self.summarized_upto = upto
+            log.debug("Conversation summary updated through message %s", upto)
+        except Exception as e:
+            log.exception(f"Error updating conversation summary: {e}")
+
+
+def current_instruction():
+    """Return the system instruction of the agent that is currently active"""
+    if "sam_active" in st.session_state and st.session_state.sam_active:
+        # If Sam is active, use Sam's instruction
+        return get_settings().get("sam_instruction", "You are Sam, a corrections manager")
+    # Otherwise use Noa's instruction
+    return get_settings().get("noa_instruction", "You are Noa, a nursing instructor")
+
+
+# Blank lines that end a Markdown block
+BLOCK_BREAK = re.compile(r"\n[ \t]*\n+")
+
+
+def pop_blocks(buffer):
+    """Split the complete Markdown blocks off the front of a streaming text buffer.
+
+    A block ends at a blank line outside a fenced code block, so it renders the
+    same on its own as it does inside the full reply.
+    Returns the complete blocks and the open remainder.
+    """
+    end = 0
+    for match in BLOCK_BREAK.finditer(buffer):
+        if buffer.count("```", 0, match.start()) % 2 == 0:
+            end = match.end()
+    return buffer[:end], buffer[end:]
+
+
+class RenderCoalescer:
+    """Renders a streaming reply in batched frames instead of once per token chunk.
+
+    Text is sent to the browser at most every interval seconds, or sooner once
+    max_chars have piled up. Finished Markdown blocks are frozen in their own
+    element, so each frame only resends the block still being written rather
+    than the whole reply. The frames and bytes each reply cost are traced as a
+    render span.
+    """
+
+    def __init__(self, box, interval=0.05, max_chars=400):
+        self.box = box
+        self.interval = interval
+        self.max_chars = max_chars
+        self.container = None
+        self.slot = None
+        self.text = ""
+        self.frozen = 0  # characters of text already frozen in finished blocks
+        self.pending = 0  # characters received since the last frame
+        self.started = None
+        self.last_frame = 0.0
+        self.chunks = 0
+        self.frames = 0
+        self.bytes = 0
+        self.unbatched_bytes = 0  # what re-rendering the whole reply for every chunk would have sent
+
+    def feed(self, chunk):
+        """Add streamed text and render a frame if one is due"""
+        if self.started is None:
+            self.started = time.monotonic()
+        self.text += chunk
+        self.chunks += 1
+        self.pending += len(chunk)
+        self.unbatched_bytes += len(self.text.encode("utf-8"))
+        if self.pending >= self.max_chars or time.monotonic() - self.last_frame >= self.interval:
+            self.render()
+
+    def _frame(self, text):
+        self.slot.markdown(text)
+        self.frames += 1
+        self.bytes += len(text.encode("utf-8"))
+
+    def render(self):
+        """Send the text received since the last frame"""
+        if not self.pending:
+            return
+        if self.container is None:
+            # Replaces anything shown while waiting for the first token
+            self.container = self.box.container()
+            self.slot = self.container.empty()
+        finished, open_block = pop_blocks(self.text[self.frozen:])
+        if finished.strip():
+            self._frame(finished)
+            self.frozen += len(finished)
+            self.slot = self.container.empty()
+        if open_block.strip():
+            self._frame(open_block)
+        self.pending = 0
+        self.last_frame = time.monotonic()
+
+    def close(self):
+        """Render the rest of the reply and trace what it cost"""
+        self.render()
+        if self.started is not None:
+            trace_span(
+                "render",
+                time.monotonic() - self.started,
+                chunks=self.chunks,
+                frames=self.frames,
+                bytes=self.bytes,
+                unbatched_bytes=self.unbatched_bytes,
+            )
+            log.debug("Rendered %d chunks in %d frames, %d bytes", self.chunks, self.frames, self.bytes)
+
+
+# Send prompt to the chat providers and get response
+def stream_response(messages, on_wait=None):
+    """Stream the active agent's reply from the fastest healthy provider; on_wait(seconds) is called while the request waits for its turn"""
+    started = time.time()
     try:
-        log.debug(f"Sending text request to OpenAI: {messages[-1]['content']}")
+        log.debug("Sending text request: %s", messages[-1]["content"])
         
-        # Get the correct system message based on which agent is active
-        if "sam_active" in st.session_state and st.session_state.sam_active:
-            # If Sam is active, use Sam's instruction
-            instruction = st.session_state.settings.get("sam_instruction", "You are Sam, a corrections manager")
-            messages_to_send = [{"role": "system", "content": instruction}] + messages[1:]
-        else:
-            # Otherwise use Noa's instruction
-            instruction = st.session_state.settings.get("noa_instruction", "You are Noa, a nursing instructor")
-            messages_to_send = [{"role": "system", "content": instruction}] + messages[1:]
+        # Get the correct system message based on which agent is active, followed by
+        # the conversation summary and the recent turns that fit in the token budget
+        messages_to_send = st.session_state.context.build(current_instruction(), messages)
+        settings = get_settings()
+        router = get_chat_router()
         
-        # Optimize for faster responses
-        stream = client.chat.completions.create(
-            model="gpt-4o",  # Directly specify model for reliability
-            messages=messages_to_send,
-            temperature=0.7,  # Direct temperature value for reliability
-            stream=True,
+        reply = ""
+        chunks = 0
+        usage = {}
+
+        turn = router.stream(
+            router.routes(settings),
+            settings.get("providers", {}),
+            messages_to_send,
+            temperature=settings["parameters"]["temperature"],
             max_tokens=800,  # Limiting max tokens for faster responses
+            session=api_session(),
+            tokens=sum(estimate_tokens(m["content"]) for m in messages_to_send),
+            on_wait=on_wait,
+        )
+        for kind, value in turn:
+            if kind == "usage":
+                st.session_state.context.record_usage(value)
+                usage = value
+                continue
+            if chunks == 0:
+                winner = turn.winner
+                trace_span("llm.queue", winner.admitted_at - winner.started, provider=winner.provider.name, attempts=len(turn.attempts))
+                trace_span(
+                    "llm.ttft",
+                    time.time() - started,
+                    provider=winner.provider.name,
+                    model=winner.model,
+                    hedged=turn.hedged,
+                )
+            chunks += 1
+            reply += value
+            yield value
+        winner = turn.winner
+        record_event(
+            "chat",
+            text=reply,
+            provider=winner.provider.name,
+            model=winner.model,
+            hedged=turn.hedged,
+            key=chat_request_key(messages_to_send),
+            prompt_messages=len(messages_to_send),
+            ttft=round((winner.first_token_at or time.time()) - started, 3),
+            seconds=round(time.time() - started, 3),
+            **usage,
+        )
+        trace_span(
+            "llm",
+            time.time() - started,
+            provider=winner.provider.name,
+            model=winner.model,
+            hedged=turn.hedged,
+            attempts=len(turn.attempts),
+            chunks=chunks,
+            chars=len(reply),
+            ttft=round((winner.first_token_at or time.time()) - started, 3),
+            **usage,
+        )
+    except ApiBusyError as e:
+        log.warning("Chat request still rate limited after retries: %s", e)
+        trace_span("llm", time.time() - started, status="busy")
+        yield (
+            "So many students are talking right now that I couldn't answer in time. "
+            f"Please send that again in about {max(5, round(e.retry_after))} seconds."
         )
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                yield chunk.choices[0].delta.content
     except Exception as e:
         log.exception("")
+        trace_span("llm", time.time() - started, status="error")
         yield "I'm sorry, there was an issue generating a response. Let's try again."
 
 
 def show_download():
-    document = create_transcript_document()
-    col1, col2 = st.columns([1, 1])
-    # Button to download the full conversation transcript
+    # Snapshot the history; the export callables run on another thread when a button is clicked
+    messages = list(st.session_state.messages)
+    transcript = st.session_state.transcript
+    col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
+    # Buttons to download the full conversation transcript, built only when clicked
     with col1:
         st.download_button(
             label="📥 Download Transcript",
-            data=document,
+            data=functools.partial(transcript.docx_bytes, messages),
             file_name="Transcript.docx",
             mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            on_click="ignore",
+        )
+    with col2:
+        st.download_button(
+            label="📄 Plain Text",
+            data=functools.partial(transcript_text, messages),
+            file_name="Transcript.txt",
+            mime="text/plain",
+            on_click="ignore",
+        )
+    with col3:
+        st.download_button(
+            label="📝 Markdown",
+            data=functools.partial(transcript_markdown, messages),
+            file_name="Transcript.md",
+            mime="text/markdown",
+            on_click="ignore",
+        )
+    with col4:
+        # The message list itself, for offline grading with tools/grade.py
+        st.download_button(
+            label="🧾 JSON",
+            data=functools.partial(json.dumps, messages, indent=1),
+            file_name="Transcript.json",
+            mime="application/json",
+            on_click="ignore",
         )
 
 
-def create_transcript_document():
-    try:
-        doc = Document()
-        doc.add_heading("Conversation Transcript\n", level=1)
-
-        for message in st.session_state.messages[1:]:
-            if message["role"] == "user":
-                p = doc.add_paragraph()
-                p.add_run("Public Health Nurse: ").bold = True
-                p.add_run(message["content"])
-            else:
-                p = doc.add_paragraph()
-                # Use the appropriate name based on which agent responded
-                if "agent" in message and message["agent"] == "sam":
-                    agent_name = "Sam Richards"
-                else:
-                    agent_name = "Noa Martinez"
-                p.add_run(f"{agent_name}: ").bold = True
-                p.add_run(message["content"])
+def speaker_name(message):
+    """Name shown for a message in the transcript"""
+    if message["role"] == "user":
+        return "Public Health Nurse"
+    # Use the appropriate name based on which agent responded
+    return agent_profile("sam" if message.get("agent") == "sam" else "noa")["name"]
+
+
+def transcript_text(messages):
+    lines = ["Conversation Transcript", ""]
+    for message in messages[1:]:
+        lines += [f"{speaker_name(message)}: {message['content']}", ""]
+    return "\n".join(lines)
+
+
+def transcript_markdown(messages):
+    lines = ["# Conversation Transcript", ""]
+    for message in messages[1:]:
+        lines += [f"**{speaker_name(message)}:** {message['content']}", ""]
+    return "\n".join(lines)
 
-        buffer = BytesIO()
-        doc.save(buffer)
-        buffer.seek(0)
-        return buffer
-    except Exception as e:
-        log.exception(f"Error creating transcript: {e}")
-        # Return empty document if error occurs
-        empty_doc = Document()
-        empty_doc.add_paragraph("Error creating transcript")
-        buffer = BytesIO()
-        empty_doc.save(buffer)
-        buffer.seek(0)
-        return buffer
+
+class TranscriptCache:
+    """Builds the DOCX transcript on demand and reuses it between downloads.
+
+    The document is kept open and only the messages added since the last
+    download are appended to it. The serialized bytes are cached by message count.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.doc = None
+        self.rendered_count = 1  # messages[1:rendered_count] are already in the document
+        self.cached_count = None
+        self.cached_bytes = None
+        self.rendered_chars = 0
+
+    def size(self):
+        """Approximate memory held: the serialized document plus the text in the open one"""
+        return len(self.cached_bytes or b"") + self.rendered_chars
+
+    def release(self):
+        """Drop the document; it is rebuilt from the messages on the next download"""
+        with self.lock:
+            self.doc, self.rendered_count, self.rendered_chars = None, 1, 0
+            self.cached_count = self.cached_bytes = None
+
+    def docx_bytes(self, messages):
+        from docx import Document
+
+        with self.lock:
+            if self.cached_count == len(messages):
+                return self.cached_bytes
+            try:
+                if self.doc is None:
+                    self.doc = Document()
+                    self.doc.add_heading("Conversation Transcript\n", level=1)
+                for message in messages[self.rendered_count:]:
+                    p = self.doc.add_paragraph()
+                    p.add_run(f"{speaker_name(message)}: ").bold = True
+                    p.add_run(message["content"])
+                    self.rendered_chars += len(message["content"])
+                self.rendered_count = len(messages)
+
+                buffer = BytesIO()
+                self.doc.save(buffer)
+                self.cached_count, self.cached_bytes = len(messages), buffer.getvalue()
+                return self.cached_bytes
+            except Exception as e:
+                log.exception(f"Error creating transcript: {e}")
+                # Start over next time and return an error document for now
+                self.doc, self.rendered_count, self.rendered_chars = None, 1, 0
+                empty_doc = Document()
+                empty_doc.add_paragraph("Error creating transcript")
+                buffer = BytesIO()
+                empty_doc.save(buffer)
+                return buffer.getvalue()
 
 
 def stop_current_audio():
-    """Function to stop any currently playing audio"""
-    if "is_speaking" in st.session_state and st.session_state.is_speaking:
-        # Add JavaScript to stop all audio elements using components.html
-        st.components.v1.html(
-            """
-            <script>
-                var audioElements = document.querySelectorAll('audio');
-                audioElements.forEach(function(audio) {
-                    audio.pause();
-                    audio.currentTime = 0;
-                });
-            </script>
-            """, 
-            height=0
-        )
-        
-        # Reset the speaking state
-        st.session_state.is_speaking = False
-        # Small delay to ensure audio stops
-        time.sleep(0.5)
+    """Stop the clip that is playing and drop the queued ones (barge-in)"""
+    send_to_player("stop")
+    st.session_state.is_speaking = False
 
 
 def play_sam_intro():
@@ -382,11 +2383,10 @@ def play_sam_intro():
                 
                 # Make sure no audio is playing
                 stop_current_audio()
-                time.sleep(0.5)
                 
                 # Play Sam's introduction
-                speech_client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-                text_to_speech(speech_client, sam_intro)
+                speech_client = get_openai_client()
+                text_to_speech(speech_client, sam_intro, cache=True)
                 
                 # Mark as played
                 st.session_state.sam_intro_needs_playing = False
@@ -407,11 +2407,10 @@ def play_debrief_intro():
                 
                 # Make sure no audio is playing
                 stop_current_audio()
-                time.sleep(0.5)
                 
                 # Play Noa's debrief introduction
-                speech_client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-                text_to_speech(speech_client, debrief_intro)
+                speech_client = get_openai_client()
+                text_to_speech(speech_client, debrief_intro, cache=True)
                 
                 # Mark as played
                 st.session_state.debrief_intro_needs_playing = False
@@ -419,83 +2418,249 @@ def play_debrief_intro():
             log.exception(f"Error playing debrief intro: {e}")
 
 
+class DebriefDraft:
+    """Noa's feedback, generated on its own thread while the meeting with Sam winds down.
+
+    upto is the number of messages of the transcript the draft was written
+    from. If the student keeps talking to Sam, the draft is cancelled and
+    started again on the longer transcript, so the feedback is ready, or
+    nearly, when the debrief begins.
+    """
+
+    def __init__(self, upto, turn):
+        self.upto = upto
+        self.turn = turn
+        self.started = time.time()
+        self.cancelled = threading.Event()
+        self.future = None
+
+    def covers(self, messages):
+        """Whether the draft was written from this transcript, ignoring the student's closing messages"""
+        return len(messages) >= self.upto and all(m["role"] == "user" for m in messages[self.upto:])
+
+    def cancel(self):
+        self.cancelled.set()
+        for attempt in list(self.turn.attempts):
+            attempt.cancel()
+
+
+def write_debrief(turn, cancelled, record=None):
+    """Collect a debrief reply from the chat router; returns None if cancelled first. Runs on the draft's own thread
+
+    record(**fields), if given, adds the draft to the session recording, cancelled or not.
+    """
+    started = time.time()
+    first_token_at = None
+    reply = ""
+    events = iter(turn)
+    try:
+        for kind, value in events:
+            if cancelled.is_set():
+                return None
+            if kind == "text":
+                first_token_at = first_token_at or time.time()
+                reply += value
+    except ApiBusyError as e:
+        log.warning("Debrief draft still rate limited after retries: %s", e)
+        return None
+    except Exception as e:
+        log.exception(f"Error drafting debrief: {e}")
+        return None
+    finally:
+        events.close()
+        if record:
+            try:
+                record(
+                    text=reply,
+                    cancelled=cancelled.is_set(),
+                    ttft=round((first_token_at or time.time()) - started, 3),
+                    seconds=round(time.time() - started, 3),
+                )
+            except Exception as e:
+                log.exception(f"Error recording debrief draft: {e}")
+    return reply.strip()
+
+
+def start_debrief_draft(messages):
+    """Start drafting Noa's feedback on the given transcript, replacing any earlier draft"""
+    draft = st.session_state.get("debrief_draft")
+    if draft is not None:
+        draft.cancel()
+    # The student's requests for feedback are replaced by the one the app sends
+    history = list(messages)
+    while history and history[-1]["role"] == "user":
+        history.pop()
+    settings = get_settings()
+    noa_instruction = settings.get("noa_instruction", "You are Noa, a nursing instructor")
+    prompt = st.session_state.context.build(
+        noa_instruction,
+        history
+        + [
+            {"role": "user", "content": "Ready for feedback on my conversation with Sam."},
+            {"role": "assistant", "content": scripted_line("debrief_intro")},
+        ],
+        record=False,
+    )
+    prompt.append({
+        "role": "system",
+        "content": "Now give the student your feedback on their conversation with Sam, "
+        "carrying on straight from what you just said.",
+    })
+    router = get_chat_router()
+    turn = router.stream(
+        router.routes(settings),
+        settings.get("providers", {}),
+        prompt,
+        temperature=settings["parameters"]["temperature"],
+        max_tokens=800,
+        session=api_session(),
+        tokens=sum(estimate_tokens(m["content"]) for m in prompt),
+    )
+    draft = DebriefDraft(len(history), turn)
+    recorder = st.session_state.get("session_recorder")
+    record = None
+    if recorder:
+        # Recorded as its own kind with its request key, so replay serves it to the draft and not to Sam
+        record = functools.partial(recorder.record, "draft", phase=current_phase(), key=chat_request_key(prompt))
+    # A draft waits on the reply for its whole generation, so it gets its own thread, like
+    # the chat attempts, rather than holding a shared worker that TTS and STT need
+    draft.future = Future()
+    threading.Thread(
+        target=lambda: draft.future.set_result(write_debrief(turn, draft.cancelled, record)),
+        name="debrief-draft",
+        daemon=True,
+    ).start()
+    st.session_state.debrief_draft = draft
+    log.info("Drafting debrief from %d messages", draft.upto)
+    return draft
+
+
+def update_debrief_draft(user_query, reply):
+    """After each turn with Sam: draft the feedback while the meeting winds down, drop the draft if it picks up again"""
+    if not get_settings()["parameters"].get("speculative_debrief", True):
+        return
+    if "wind_down" in find_signals(user_query) | find_signals(reply):
+        start_debrief_draft(st.session_state.messages)
+    elif st.session_state.get("debrief_draft") is not None:
+        log.info("Meeting with Sam continues, dropping the debrief draft")
+        st.session_state.debrief_draft.cancel()
+        st.session_state.debrief_draft = None
+
+
+def deliver_debrief_feedback(speech_client):
+    """Show and speak Noa's drafted feedback after the debrief intro"""
+    st.session_state.debrief_feedback_pending = False
+    draft = st.session_state.pop("debrief_draft", None)
+    if draft is None:
+        return
+    agent = agent_profile("noa")
+    with st.chat_message(agent["name"], avatar=asset_source(agent["avatar"])):
+        waited = time.time()
+        ready = draft.future.done()
+        with st.spinner("Noa is putting the feedback together..."):
+            feedback = draft.future.result()
+        trace_span(
+            "debrief.wait", time.time() - waited, ready=ready, drafted_seconds=round(time.time() - draft.started, 3)
+        )
+        if not feedback:
+            feedback = "I'm sorry, there was an issue generating a response. Let's try again."
+        st.markdown(feedback)
+    record_event("feedback", text=feedback, ready=ready, seconds=round(time.time() - waited, 3))
+    st.session_state.messages.append({"role": "assistant", "content": feedback, "agent": "noa"})
+    if get_settings()["parameters"].get("streaming_tts", True):
+        speech = SpeechPipeline(speech_client, current_voice())
+        speech.feed(feedback)
+        speech.close()
+    else:
+        text_to_speech(speech_client, feedback, queued=True)
+
+
+def start_sam_meeting():
+    """Switch from Noa's pre-brief to the meeting with Sam"""
+    st.session_state.pending_transition = None
+    st.session_state.sam_active = True
+
+    # Add Sam's first message
+    sam_intro = scripted_line("sam_intro")
+    st.session_state.messages.append({
+        "role": "assistant", 
+        "content": sam_intro,
+        "agent": "sam"
+    })
+
+    # Play Sam's audio when the UI is drawn
+    st.session_state.sam_intro_needs_playing = True
+    log.info("Noa's transition message complete, now switching to Sam")
+
+
+def handle_audio_events():
+    """Draw the audio player and advance a pending transition once it reports that its clip has ended"""
+    with st.sidebar:
+        playback = audio_player(key="audio_player", default=None)
+    pending = st.session_state.pending_transition
+    if pending and playback and playback.get("ended") == pending["clip"]:
+        log.info("Clip %s %s", pending["clip"], playback.get("reason"))
+        if pending["next"] == "sam":
+            start_sam_meeting()
+
+
 def process_user_query(text_client, speech_client, user_query):
     # Stop any currently playing audio when user inputs something new
     stop_current_audio()
+
+    # The student spoke over the transition clip; don't keep them waiting for it.
+    # Rerun so the page switches to Sam, then answer the query from manual_input
+    if st.session_state.pending_transition and st.session_state.pending_transition["next"] == "sam":
+        start_sam_meeting()
+        st.session_state.manual_input = user_query
+        st.rerun()
+
+    st.session_state.turn += 1
+    record_event("user", text=user_query)
     
     # Check for transition triggers
+    transition = next_phase(current_phase(), user_query)
     
     # 1. Transition from Noa to Sam (pre-brief to simulation)
-    if not st.session_state.sam_active and not st.session_state.debrief_active:
-        # Enhanced pattern matching for readiness signals
-        ready_pattern = r"ready|begin|start|yes|yeah|sure|ok|okay|yep|let'?s|meet sam|proceed|sleep|go"
+    if transition == "sam":
+        # Display the user's query first
+        with st.chat_message("Public Health Nurse", avatar=asset_source(USER_AVATAR)):
+            st.markdown(user_query)
         
-        if re.search(ready_pattern, user_query.lower()):
-            # Display the user's query first
-            with st.chat_message("Public Health Nurse", avatar="assets/User.png"):
-                st.markdown(user_query)
-            
-            # Store the user's query into the history
-            st.session_state.messages.append({"role": "user", "content": user_query.strip()})
-            
-            # DIRECT TRANSITION - Simplified to ensure it works
-            # Add Noa's transition message
-            transition_message = "Great! I'll introduce you to Sam now. Remember to focus on addressing his specific concerns while emphasizing the benefits to his facility. Good luck!"
-            st.session_state.messages.append({
-                "role": "assistant", 
-                "content": transition_message,
-                "agent": "noa"
-            })
-            
-            # Play Noa's transition audio and wait for it to complete
-            try:
-                # Calculate approximately how long the audio will take to play
-                # A conservative estimate is about 100-125 words per minute (slower than normal speech)
-                # This translates to roughly 1.7-2 words per second
-                word_count = len(transition_message.split())
-                estimated_seconds = word_count / 1.7  # Conservative estimate
-                
-                # Add a generous buffer to ensure audio completes
-                wait_time = estimated_seconds + 2.0  # 2 second buffer after estimated completion
-                
-                # Play Noa's audio
-                text_to_speech(speech_client, transition_message)
-                
-                # Log the waiting time
-                log.info(f"Waiting {wait_time} seconds for Noa's audio to complete")
-                
-                # Wait for estimated audio duration plus buffer
-                time.sleep(wait_time)
-                
-                # Make sure any audio has completely stopped
-                stop_current_audio()
-                time.sleep(1.0)  # Additional pause after stopping audio
-                
-                log.info("Noa's transition message complete, now switching to Sam")
-                
-            except Exception as e:
-                log.exception(f"Error playing transition audio: {e}")
-            
-            # Set sam_active to True
-            st.session_state.sam_active = True
-            
-            # Add Sam's first message
-            sam_intro = "Hello, I'm Sam Richards, Operations Manager here at the County Corrections Facility. I understand you're here about some flu vaccination program? Look, I've got 500 inmates to manage, an understaffed facility, and security concerns you wouldn't believe. I'm not sure how you expect this to work in our environment. What exactly are you proposing?"
-            st.session_state.messages.append({
-                "role": "assistant", 
-                "content": sam_intro,
-                "agent": "sam"
-            })
-            
-            # Force a rerun to update the UI and play Sam's audio on the next cycle
-            st.session_state.sam_intro_needs_playing = True
-            st.rerun()
-            return  # Skip further processing since we're handling the transition
+        # Store the user's query into the history
+        st.session_state.messages.append({"role": "user", "content": user_query.strip()})
+        
+        # DIRECT TRANSITION - Simplified to ensure it works
+        # Add Noa's transition message
+        transition_message = scripted_line("transition")
+        st.session_state.messages.append({
+            "role": "assistant", 
+            "content": transition_message,
+            "agent": "noa"
+        })
+        
+        noa = agent_profile("noa")
+        with st.chat_message(noa["name"], avatar=asset_source(noa["avatar"])):
+            st.markdown(transition_message)
+
+            # Play Noa's transition audio; Sam joins once the browser reports it has ended
+            clip_id = f"transition_{get_uuid()}"
+            audio = text_to_speech(speech_client, transition_message, cache=True, clip_id=clip_id)
+
+        if audio:
+            log.info("Waiting for transition clip %s to finish playing", clip_id)
+            st.session_state.pending_transition = {"clip": clip_id, "next": "sam"}
+            return
+
+        # Without audio there is nothing to wait for
+        start_sam_meeting()
+        st.rerun()
+        return  # Skip further processing since we're handling the transition
     
     # 2. Transition from Sam to Noa (simulation to debrief)
-    if st.session_state.sam_active and not st.session_state.debrief_active and re.search(r"ready for feedback|end session|finish|complete|goodbye", user_query.lower()):
+    if transition == "debrief":
         # Display the user's query
-        with st.chat_message("Public Health Nurse", avatar="assets/User.png"):
+        with st.chat_message("Public Health Nurse", avatar=asset_source(USER_AVATAR)):
             st.markdown(user_query)
 
         # Store the user's query into the history
@@ -512,7 +2677,7 @@ def process_user_query(text_client, speech_client, user_query):
         st.session_state.download_transcript = True
         
         # Add Noa's debrief introduction message
-        debrief_intro = "So, how do you think that went? That wasn't easy - Sam can be quite challenging! I was really impressed with how you managed to stay calm and professional throughout the conversation, especially when he brought up some tough concerns. Let me give you some feedback on your performance."
+        debrief_intro = scripted_line("debrief_intro")
         st.session_state.messages.append({
             "role": "assistant", 
             "content": debrief_intro,
@@ -521,13 +2686,19 @@ def process_user_query(text_client, speech_client, user_query):
         
         # Set flag to play debrief audio on next cycle
         st.session_state.debrief_intro_needs_playing = True
+
+        # Noa's feedback follows the intro; it is usually already drafted by now
+        st.session_state.debrief_feedback_pending = True
+        draft = st.session_state.get("debrief_draft")
+        if draft is None or not draft.covers(st.session_state.messages[:-1]):
+            start_debrief_draft(st.session_state.messages[:-1])
         
         # Force a rerun to update the UI
         st.rerun()
         return
     
     # Display the user's query
-    with st.chat_message("Public Health Nurse", avatar="assets/User.png"):
+    with st.chat_message("Public Health Nurse", avatar=asset_source(USER_AVATAR)):
         st.markdown(user_query)
 
     # Store the user's query into the history
@@ -536,36 +2707,550 @@ def process_user_query(text_client, speech_client, user_query):
     # Stream the assistant's reply
     # Determine which agent is responding
     current_agent = "sam" if st.session_state.sam_active else "noa"
-    agent_name = "Sam Richards" if st.session_state.sam_active else "Noa Martinez"
-    agent_avatar = "assets/Sam.jpg" if st.session_state.sam_active else "assets/Noa.jpg"
+    agent = agent_profile(current_agent)
     
-    with st.chat_message(agent_name, avatar=agent_avatar):
+    with st.chat_message(agent["name"], avatar=asset_source(agent["avatar"])):
         # Empty container to display the assistant's reply
         assistant_reply_box = st.empty()
 
         # A blank string to store the assistant's reply
         assistant_reply = ""
 
+        # Batch the streamed chunks into a few frames instead of re-rendering the reply per chunk
+        parameters = get_settings().get("parameters", {})
+        render = RenderCoalescer(assistant_reply_box, interval=parameters.get("render_interval_ms", 50) / 1000)
+
+        # Speak each sentence as soon as it is complete instead of waiting for the full reply
+        speech = None
+        if parameters.get("streaming_tts", True):
+            speech = SpeechPipeline(speech_client, current_voice())
+            st.session_state.is_speaking = True
+
+        def show_wait(seconds):
+            if seconds >= 1:
+                assistant_reply_box.info(
+                    f"⏳ Lots of students are talking right now. {agent['name']} will answer in about "
+                    f"{max(1, round(seconds))} seconds."
+                )
+
         # Iterate through the stream
-        for chunk in stream_response_openai(text_client, st.session_state.messages):
+        for chunk in stream_response(st.session_state.messages, on_wait=show_wait):
             assistant_reply += chunk
-            assistant_reply_box.markdown(assistant_reply)
+            render.feed(chunk)
+            if speech:
+                speech.feed(chunk)
+        render.close()
 
         # Once the stream is over, update chat history with agent info
         st.session_state.messages.append(
             {"role": "assistant", "content": assistant_reply.strip(), "agent": current_agent}
         )
         
-        # Play audio response AFTER the full text is shown
-        text_to_speech(speech_client, assistant_reply)
+        # Play the rest of the audio response, or all of it when streaming TTS is off
+        if speech:
+            speech.close()
+            st.session_state.is_speaking = False
+        else:
+            text_to_speech(speech_client, assistant_reply)
         
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("OpenAI connection pool: %s", get_client_registry().stats())
+
+        # Summarize the turns that no longer fit in the prompt while the student reads the reply
+        st.session_state.context.refresh_summary(text_client, current_instruction(), st.session_state.messages)
+
         # Update ready_for_sam flag after Noa responds
         if not st.session_state.sam_active and not st.session_state.debrief_active:
             st.session_state.ready_for_sam = check_readiness_for_sam()
 
+        # Start on Noa's feedback once the meeting with Sam sounds like it's ending
+        if current_phase() == "sam":
+            update_debrief_draft(user_query, assistant_reply)
+
+
+class SessionStore:
+    """Keeps session checkpoints outside the app process.
+
+    Checkpoints survive restarts and can be picked up by any replica that
+    shares the store, so a student who reconnects continues where they left off. save is a
+    compare-and-set on the checkpoint version, so two replicas serving the
+    same session can't silently overwrite each other's turns.
+    """
+
+    def load(self, key):
+        """Return (version, state) of a saved session, or None"""
+        raise NotImplementedError
+
+    def save(self, key, version, state):
+        """Store state as version + 1 if the saved version is still version; return whether it was stored"""
+        raise NotImplementedError
+
+
+class SQLiteSessionStore(SessionStore):
+    """Session checkpoints in a SQLite database in WAL mode.
+
+    With WAL, readers don't block the writer, so several app processes on the
+    same host can share one database file. WAL needs shared memory between
+    the processes, so the file must be on a local disk of that host, never on
+    a network file system (NFS, SMB) shared across machines.
+    Checkpoints not updated for ttl seconds are deleted.
+    """
+
+    def __init__(self, path, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "key TEXT PRIMARY KEY, version INTEGER NOT NULL, state TEXT NOT NULL, updated REAL NOT NULL)"
+            )
+        self.purge()
+
+    def purge(self):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,))
+        self.purged_at = time.time()
+
+    def load(self, key):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT version, state FROM sessions WHERE key = ? AND updated >= ?", (key, time.time() - self.ttl)
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def save(self, key, version, state):
+        if time.time() - self.purged_at > 3600:
+            self.purge()
+        data = json.dumps(state)
+        with self.lock, self.db:
+            if version == 0:
+                cursor = self.db.execute(
+                    "INSERT OR IGNORE INTO sessions VALUES (?, 1, ?, ?)", (key, data, time.time())
+                )
+            else:
+                cursor = self.db.execute(
+                    "UPDATE sessions SET version = version + 1, state = ?, updated = ? WHERE key = ? AND version = ?",
+                    (data, time.time(), key, version),
+                )
+        return cursor.rowcount == 1
+
+
+class MemorySessionStore(SessionStore):
+    """In-process stand-in for a shared key-value store such as Redis.
+
+    Checkpoints are stored as JSON with an expiry time, exactly as they would be
+    sent to a remote store. This keeps single-process development and tests
+    honest about what survives a checkpoint. It does not survive a restart,
+    and other processes can't see it, so it can't be shared by replicas.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> (version, JSON state, expires_at)
+
+    def load(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or entry[2] <= time.time():
+            return None
+        return entry[0], json.loads(entry[1])
+
+    def save(self, key, version, state):
+        data = json.dumps(state)
+        now = time.time()
+        with self.lock:
+            for expired in [k for k, entry in self.entries.items() if entry[2] <= now]:
+                del self.entries[expired]
+            saved_version = self.entries.get(key, (0,))[0]
+            if saved_version != version:
+                return False
+            self.entries[key] = (version + 1, data, now + self.ttl)
+        return True
+
+
+@st.cache_resource
+def get_session_store():
+    """Create the process-wide session store, or return None when checkpoints are off"""
+    store_settings = get_settings().get("session_store", {})
+    backend = store_settings.get("backend", "sqlite")
+    ttl = store_settings.get("ttl_hours", 24) * 3600
+    if backend == "sqlite":
+        return SQLiteSessionStore(store_settings.get("path", "sessions.db"), ttl)
+    if backend == "memory":
+        return MemorySessionStore(ttl)
+    return None
+
+
+# Session state saved in each checkpoint and restored when a student reconnects
+PERSISTED_STATE = (
+    "session_id", "turn", "start_time", "chat_active", "show_intro",
+    "sam_active", "debrief_active", "ready_for_sam", "end_session_button_clicked",
+    "download_transcript", "messages",
+)
+
+
+def session_snapshot():
+    """The part of the session state that is saved in a checkpoint"""
+    state = {name: st.session_state[name] for name in PERSISTED_STATE if name in st.session_state}
+    context = st.session_state.context
+    with context.lock:
+        state["summary"] = [context.summary, context.summarized_upto]
+    return state
+
+
+def apply_snapshot(state):
+    """Replace the session state with a saved checkpoint"""
+    for name in PERSISTED_STATE:
+        if name in state:
+            st.session_state[name] = state[name]
+    context = st.session_state.context
+    with context.lock:
+        context.summary, context.summarized_upto = state.get("summary", ["", 1])
+    # Caches derived from the messages are rebuilt from scratch
+    st.session_state.readiness = ReadinessTracker()
+    st.session_state.transcript = TranscriptCache()
+    st.session_state.archive = [0, ""]
+    st.session_state.pending_transition = None
+    # The welcome was queued when the access code was entered, but this conversation is already under way
+    st.session_state.welcome_audio_needs_playing = False
+    # Saved while Noa's transition clip was playing: go straight on to Sam
+    if (
+        current_phase() == "prebrief"
+        and st.session_state.messages[-1]["role"] == "assistant"
+        and st.session_state.messages[-1]["content"] == scripted_line("transition")
+    ):
+        start_sam_meeting()
+
+
+def checkpoint_fingerprint():
+    """Changes whenever something worth a new checkpoint has happened"""
+    return (
+        len(st.session_state.messages),
+        current_phase(),
+        st.session_state.ready_for_sam,
+        st.session_state.download_transcript,
+    )
+
+
+def restore_session():
+    """Rehydrate the session from the store when the page URL carries the key of a saved session"""
+    checkpoint = st.session_state.checkpoint
+    residency = st.session_state.residency
+    if residency.offloaded:
+        # The memory accountant released this idle session; bring it back from its checkpoint
+        residency.offloaded = False
+        key = checkpoint["key"]
+    elif checkpoint["key"] is None:
+        # The key alone doesn't skip the access code; the session is restored once it has been entered
+        if not st.session_state.get("password_correct"):
+            return
+        key = st.query_params.get("sid")
+    else:
+        return
+    if not key:
+        return
+    store = get_session_store()
+    if not store:
+        return
+    try:
+        saved = store.load(key)
+    except Exception as e:
+        log.exception(f"Error loading session checkpoint: {e}")
+        return
+    if saved is None:
+        log.info("No saved session for key %s, starting a new one", key)
+        if "sid" in st.query_params:
+            del st.query_params["sid"]
+        return
+    version, state = saved
+    apply_snapshot(state)
+    checkpoint.update(key=key, version=version, fingerprint=checkpoint_fingerprint())
+    log.info("Restored session %s from checkpoint version %s", st.session_state.session_id, version)
+
+
+def checkpoint_session():
+    """Save the session to the store if a turn or phase change happened since the last checkpoint"""
+    checkpoint = st.session_state.checkpoint
+    if not st.session_state.get("password_correct"):
+        return
+    fingerprint = checkpoint_fingerprint()
+    if fingerprint == checkpoint["fingerprint"]:
+        return
+    store = get_session_store()
+    if not store:
+        return
+    if checkpoint["key"] is None:
+        # Unguessable, since anyone holding the key can resume the session
+        checkpoint["key"] = secrets.token_urlsafe(16)
+        st.query_params["sid"] = checkpoint["key"]
+    try:
+        with trace("checkpoint"):
+            saved = store.save(checkpoint["key"], checkpoint["version"], session_snapshot())
+    except Exception as e:
+        log.exception(f"Error saving session checkpoint: {e}")
+        return
+    if saved:
+        checkpoint.update(version=checkpoint["version"] + 1, fingerprint=fingerprint)
+        return
+
+    # Another replica or tab moved this session on; continue from its state
+    log.warning("Session %s was changed elsewhere, reloading it", st.session_state.session_id)
+    loaded = store.load(checkpoint["key"])
+    if loaded:
+        version, state = loaded
+        apply_snapshot(state)
+        checkpoint.update(version=version, fingerprint=checkpoint_fingerprint())
+        st.rerun()
+
+
+def rss_bytes():
+    """Resident set size of the server process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Session state keys of the voice input widgets, whose values hold the recorded audio
+AUDIO_WIDGET_KEYS = ("chunked_recorder", "recorder", "recorder_output")
+
+
+def value_bytes(value):
+    """Approximate bytes of the strings and bytes in a widget value"""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(value_bytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(value_bytes(item) for item in value)
+    return 0
+
+
+class SessionResidency:
+    """What the memory accountant knows about one session.
+
+    Holds references to the session's large objects so that an idle session,
+    whose script isn't running, can be released from outside. The lock is held
+    while the session's script runs, so a session is never released mid-run.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.offloaded = False
+        self.last_active = time.time()
+        self.session_id = None
+        self.runtime_id = None  # Streamlit's id for the session
+        self.phase = None
+        self.checkpointed = False  # the session store holds everything up to the last run
+        self.parts = {}  # name -> the session's object
+        self.footprint = {}  # name -> approximate bytes
+
+    def measure(self):
+        parts = self.parts
+        self.footprint = {
+            # Text plus dict overhead; the system message is the shared instruction from the settings
+            "messages": sum(len(m["content"]) + 200 for m in parts.get("messages", [])[1:]),
+            "transcript": parts["transcript"].size() if "transcript" in parts else 0,
+            "archive": len(parts["archive"][1]) if "archive" in parts else 0,
+            "summary": len(parts["context"].summary) if "context" in parts else 0,
+            # Base64 segments and recordings; Streamlit keeps them until the widget sends a new value
+            "audio": value_bytes(parts.get("audio")),
+        }
+
+    def total(self):
+        return sum(self.footprint.values())
+
+    def offload(self):
+        """Release the session's large objects; returns False if its script is running"""
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            if "transcript" in self.parts:
+                self.parts["transcript"].release()
+            if "archive" in self.parts:
+                self.parts["archive"][:] = [0, ""]
+            # The conversation itself is only dropped when it can be restored from the session store
+            if self.checkpointed and "messages" in self.parts:
+                del self.parts["messages"][1:]
+                with self.parts["context"].lock:
+                    self.parts["context"].summary = ""
+                self.offloaded = True
+            self.measure()
+            return True
+        finally:
+            self.lock.release()
+
+
+class MemoryAccountant:
+    """Tracks the memory footprint of every session and releases idle ones.
+
+    A background sweep offloads sessions idle for longer than idle_seconds and,
+    while the sessions together hold more than max_bytes, the least recently
+    active ones. Offloaded sessions are restored from the session store when
+    the student comes back. Sessions that Streamlit has closed are forgotten.
+    """
+
+    def __init__(self, idle_seconds, max_bytes, min_idle_seconds=60):
+        self.idle_seconds = idle_seconds
+        self.max_bytes = max_bytes
+        self.min_idle_seconds = min_idle_seconds
+        self.lock = threading.Lock()
+        self.sessions = {}  # runtime id -> SessionResidency
+        self.offloaded_total = 0
+
+    def update(self, residency):
+        with self.lock:
+            self.sessions[residency.runtime_id] = residency
+
+    def forget_closed(self):
+        """Drop sessions that Streamlit no longer knows about"""
+        try:
+            session_mgr = get_instance()._session_mgr
+        except Exception:
+            return  # no Streamlit server, e.g. under AppTest
+        with self.lock:
+            for runtime_id in list(self.sessions):
+                if session_mgr.get_session_info(runtime_id) is None:
+                    del self.sessions[runtime_id]
+
+    def sweep(self, force=False):
+        """Offload idle sessions and enforce the memory cap; returns the number offloaded.
+
+        With force=True every session idle for at least min_idle_seconds is offloaded.
+        """
+        self.forget_closed()
+        now = time.time()
+        with self.lock:
+            candidates = sorted((r for r in self.sessions.values() if not r.offloaded), key=lambda r: r.last_active)
+        total = sum(r.total() for r in candidates)
+        offloaded = 0
+        for residency in candidates:
+            idle = now - residency.last_active
+            over_cap = total > self.max_bytes and idle >= self.min_idle_seconds
+            if idle >= self.idle_seconds or over_cap or (force and idle >= self.min_idle_seconds):
+                before = residency.total()
+                if residency.offload():
+                    total -= before - residency.total()
+                    offloaded += 1
+        if offloaded:
+            self.offloaded_total += offloaded
+            log.info("Offloaded %s idle sessions, sessions now hold %s bytes", offloaded, total)
+        return offloaded
+
+    def report(self):
+        """One row per session, most recently active first"""
+        with self.lock:
+            sessions = sorted(self.sessions.values(), key=lambda r: r.last_active, reverse=True)
+        now = time.time()
+        return [
+            {
+                "session": r.session_id,
+                "phase": r.phase,
+                "messages": len(r.parts.get("messages", [])),
+                "kb": round(r.total() / 1024, 1),
+                "idle_min": round((now - r.last_active) / 60, 1),
+                "offloaded": r.offloaded,
+            }
+            for r in sessions
+        ]
+
+
+@st.cache_resource
+def get_memory_accountant():
+    """Create the process-wide memory accountant and start its background sweep"""
+    memory = get_settings().get("memory", {})
+    accountant = MemoryAccountant(
+        memory.get("idle_minutes", 30) * 60, int(memory.get("max_session_mb", 500) * 1024 * 1024)
+    )
+
+    def sweep_forever():
+        while True:
+            time.sleep(memory.get("sweep_seconds", 60))
+            try:
+                accountant.sweep()
+            except Exception as e:
+                log.exception(f"Error sweeping idle sessions: {e}")
+
+    threading.Thread(target=sweep_forever, name="memory-sweep", daemon=True).start()
+    return accountant
+
+
+@contextmanager
+def session_residency():
+    """Hold the session's residency lock while its script runs"""
+    if "residency" not in st.session_state:
+        st.session_state.residency = SessionResidency()
+    with st.session_state.residency.lock:
+        yield st.session_state.residency
+
+
+def account_session():
+    """Record the session's footprint and activity with the memory accountant"""
+    try:
+        residency = st.session_state.residency
+        residency.last_active = time.time()
+        residency.session_id = st.session_state.session_id
+        residency.runtime_id = get_script_run_ctx().session_id
+        residency.phase = current_phase()
+        residency.checkpointed = st.session_state.checkpoint["fingerprint"] == checkpoint_fingerprint()
+        residency.parts = {
+            "messages": st.session_state.messages,
+            "transcript": st.session_state.transcript,
+            "archive": st.session_state.archive,
+            "context": st.session_state.context,
+            "audio": {key: st.session_state.get(key) for key in AUDIO_WIDGET_KEYS},
+        }
+        residency.measure()
+        get_memory_accountant().update(residency)
+    except Exception as e:
+        log.exception(f"Error accounting session memory: {e}")
+
+
+def show_admin_page():
+    """Memory use of the sessions in this server process, for staff with the admin password"""
+    st.title("Sessions")
+    if "admin_password" not in st.secrets:
+        st.info("Add admin_password to the app secrets to use this page.")
+        return
+    if not st.session_state.get("admin_ok"):
+        with st.form("Admin"):
+            password = st.text_input("Admin password", type="password")
+            if st.form_submit_button("Open"):
+                st.session_state.admin_ok = hmac.compare_digest(password, st.secrets["admin_password"])
+                if not st.session_state.admin_ok:
+                    st.error("😕 Invalid password")
+                    return
+                st.rerun()
+        return
+
+    accountant = get_memory_accountant()
+    if st.button("Offload idle sessions now"):
+        st.toast(f"Offloaded {accountant.sweep(force=True)} sessions")
+    sessions = accountant.report()
+    columns = st.columns(4)
+    columns[0].metric("Sessions", len(sessions))
+    columns[1].metric("Active in last 5 min", sum(1 for r in sessions if r["idle_min"] < 5))
+    columns[2].metric("Held by sessions", f"{sum(r['kb'] for r in sessions):,.0f} KB")
+    columns[3].metric("Server RSS", f"{rss_bytes() / 1024 / 1024:.0f} MB")
+    st.caption(
+        f"Sessions are offloaded after {accountant.idle_seconds / 60:.0f} idle minutes, or sooner while "
+        f"sessions hold more than {accountant.max_bytes / 1024 / 1024:.0f} MB. "
+        f"{accountant.offloaded_total} offloaded since the server started."
+    )
+    st.dataframe(sessions, width="stretch")
+
+    st.subheader("Chat providers")
+    st.dataframe(get_chat_router().stats(), width="stretch")
+
 
 # Initialize session state
-def init_session():
+def init_session(settings):
     if "show_intro" not in st.session_state:
         st.session_state.show_intro = True
     
@@ -593,24 +3278,64 @@ def init_session():
     if "start_time" not in st.session_state:
         st.session_state.start_time = time.time()
     
-    if "settings" not in st.session_state:
-        st.session_state.settings = load_settings()
-    
     if "messages" not in st.session_state:
         # Initialize with a system message using Noa's instruction
         st.session_state.messages = [
-            {"role": "system", "content": st.session_state.settings.get("instruction", "You are a helpful assistant")}
+            {"role": "system", "content": settings.get("instruction", "You are a helpful assistant")}
         ]
     
+    if "archive" not in st.session_state:
+        st.session_state.archive = [0, ""]
+    
+    if "transcript" not in st.session_state:
+        st.session_state.transcript = TranscriptCache()
+    
+    if "context" not in st.session_state:
+        context_settings = settings.get("context", {})
+        st.session_state.context = ConversationContext(
+            max_prompt_tokens=context_settings.get("max_prompt_tokens", 6000),
+            keep_turns=context_settings.get("keep_turns", 8),
+            summary_model=context_settings.get("summary_model", "gpt-4o-mini"),
+        )
+    
     if "ready_for_sam" not in st.session_state:
         st.session_state.ready_for_sam = False
         
+    if "readiness" not in st.session_state:
+        st.session_state.readiness = ReadinessTracker()
+        
     if "transition_attempted" not in st.session_state:
         st.session_state.transition_attempted = False
         
     if "is_speaking" not in st.session_state:
         st.session_state.is_speaking = False
 
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = get_uuid()
+
+    if "session_recorder" not in st.session_state:
+        recording_settings = settings.get("recording", {})
+        st.session_state.session_recorder = None
+        if recording_settings.get("enabled", False):
+            st.session_state.session_recorder = SessionRecorder(
+                recording_settings.get("directory", "recordings"), st.session_state.session_id
+            )
+    
+    if "script_runs" not in st.session_state:
+        st.session_state.script_runs = 0
+    
+    if "turn" not in st.session_state:
+        st.session_state.turn = 0
+    
+    if "recording" not in st.session_state:
+        st.session_state.recording = {"id": None, "segments": {}, "final_count": None}
+    
+    if "pending_transition" not in st.session_state:
+        st.session_state.pending_transition = None
+    
+    if "checkpoint" not in st.session_state:
+        st.session_state.checkpoint = {"key": None, "version": 0, "fingerprint": None}
+
 
 def setup_sidebar():
     # Simplified sidebar that doesn't rely on nested dictionary access
@@ -618,8 +3343,9 @@ def setup_sidebar():
         st.sidebar.header("Meeting with Sam Richards")
         container = st.sidebar.container(border=True)
         with container:
-            st.image("assets/Sam.jpg")
-            st.subheader("Name: Sam Richards")
+            sam = agent_profile("sam")
+            st.image(asset_source(sam["avatar"]))
+            st.subheader(f"Name: {sam['name']}")
             st.subheader("Position: Operations Manager")
             st.subheader("Years in Position: 14")
             st.subheader("Facility: County Corrections Facility")
@@ -627,8 +3353,9 @@ def setup_sidebar():
         st.sidebar.header("Session with Noa Martinez")
         container = st.sidebar.container(border=True)
         with container:
-            st.image("assets/Noa.jpg")
-            st.subheader("Name: Noa Martinez")
+            noa = agent_profile("noa")
+            st.image(asset_source(noa["avatar"]))
+            st.subheader(f"Name: {noa['name']}")
             st.subheader("Position: Clinical Nursing Instructor")
             st.subheader("Institution: Columbia University School of Nursing")
 
@@ -648,56 +3375,51 @@ def setup_sidebar():
 
 def check_readiness_for_sam():
     """Check if conversation has reached a point where transition to Sam should happen"""
-    # If user has indicated readiness in recent messages
-    if "messages" in st.session_state and len(st.session_state.messages) >= 2:
-        # Look at the last 3 user messages to check for readiness signals
-        user_messages = [msg for msg in st.session_state.messages[-6:] if msg["role"] == "user"]
-        if user_messages:
-            for msg in user_messages:
-                user_text = msg["content"].lower()
-                ready_phrases = [
-                    "ready to meet", "meet sam", "meet with sam", "start simulation", 
-                    "begin simulation", "let's start", "i'm ready", "ready to begin",
-                    "begin", "start", "yes", "sure", "okay", "ok", "yep", "yeah"
-                ]
-                for phrase in ready_phrases:
-                    if phrase in user_text:
-                        return True
-                    
-        # If we have enough conversation history, Noa should ask if ready
-        if len(st.session_state.messages) >= 6:
-            # Check if the most recent Noa message asks about readiness
-            noa_messages = [msg for msg in st.session_state.messages[-3:] 
-                         if msg["role"] == "assistant" and ("agent" not in msg or msg["agent"] == "noa")]
-            if noa_messages:
-                for msg in noa_messages:
-                    noa_text = msg["content"].lower()
-                    if any(phrase in noa_text for phrase in ["ready to start", "ready to meet", "would you like to meet", "shall we begin"]):
-                        # Noa asked if ready; next user message could trigger transition
-                        return True
-            
-            # If we've had a lot of back and forth with Noa, suggest transition
-            if len(st.session_state.messages) >= 10:
-                return True
-    
-    return False
+    return st.session_state.readiness.ready(st.session_state.messages)
+
+
+def archived_markdown(messages):
+    """Markdown for the turns that are no longer shown as chat bubbles, extended incrementally"""
+    archive = st.session_state.archive
+    count, text = archive
+    if count > len(messages):
+        count, text = 0, ""
+    for message in messages[count:]:
+        text += f"**{speaker_name(message)}:** {message['content']}\n\n"
+    archive[:] = [len(messages), text]  # updated in place so the memory accountant can release it
+    return text
+
+
+@st.fragment
+def show_archived_messages(archived):
+    """Toggle for the older turns; a fragment, so opening it doesn't rerun the whole app"""
+    if st.toggle(f"Show {len(archived)} earlier messages", key="show_archived"):
+        with st.container(border=True):
+            st.markdown(archived_markdown(archived))
 
 
 def show_messages():
-    for message in st.session_state.messages[1:]:
+    """Show the most recent messages as chat bubbles and collapse the older ones.
+
+    Only the last visible_messages messages are sent as individual chat elements
+    on each rerun. Older turns are sent only when the student asks for them,
+    as a single markdown block that Streamlit's message cache can send by reference.
+    """
+    messages = st.session_state.messages[1:]
+    visible = get_settings()["display"]["visible_messages"]
+    archived, recent = messages[:-visible], messages[-visible:]
+
+    if archived:
+        show_archived_messages(archived)
+
+    for message in recent:
         if message["role"] == "user":
-            name = "Public Health Nurse"
-            avatar = "assets/User.png"
+            avatar = USER_AVATAR
         else:
             # Determine which agent's info to use based on the message
-            if "agent" in message and message["agent"] == "sam":
-                name = "Sam Richards"
-                avatar = "assets/Sam.jpg"
-            else:
-                name = "Noa Martinez"
-                avatar = "assets/Noa.jpg"
+            avatar = agent_profile("sam" if message.get("agent") == "sam" else "noa")["avatar"]
                 
-        with st.chat_message(name, avatar=avatar):
+        with st.chat_message(speaker_name(message), avatar=asset_source(avatar)):
             st.markdown(message["content"])
 
 
@@ -720,25 +3442,126 @@ def handle_audio_input(client):
             return None
 
 
+def transcribe_segment(client, audio_bytes, mime, session):
+    """Transcribe one recorded segment; safe to run on a worker thread"""
+    audio_bio = io.BytesIO(audio_bytes)
+    audio_bio.name = "segment.mp4" if "mp4" in mime else "segment.webm"
+    return get_api_scheduler().call(
+        "transcription",
+        "whisper-1",
+        lambda: client.audio.transcriptions.create(model="whisper-1", response_format="text", file=audio_bio),
+        session,
+    )
+
+
+def stitch_transcript(segments, wait=False):
+    """Join the transcripts of consecutive finished segments, optionally waiting for all of them"""
+    parts = []
+    for index in sorted(segments):
+        future = segments[index]
+        if not wait and not future.done():
+            break
+        try:
+            parts.append(future.result().strip())
+        except Exception as e:
+            log.exception(f"Error transcribing segment {index}: {e}")
+    return " ".join(part for part in parts if part)
+
+
+def show_partial_transcript():
+    """Transcript of the recording in progress, as far as its segments have been transcribed"""
+    partial = stitch_transcript(st.session_state.recording["segments"])
+    if partial:
+        st.caption(f"🎙 {partial} …")
+
+
+def handle_chunked_audio_input(client):
+    """Record in segments and transcribe each one as soon as it arrives.
+
+    Partial transcripts are shown under the recorder while the student is still
+    speaking. When recording stops only the last segment is still being
+    transcribed, so the full transcript is ready shortly after.
+    """
+    recording = st.session_state.recording
+    event = st.session_state.get("chunked_recorder")
+    if event and event.get("recording") and event["recording"] != st.session_state.processed_audio:
+        if event["recording"] != recording["id"]:
+            recording = st.session_state.recording = {"id": event["recording"], "segments": {}, "final_count": None}
+        for index, segment in event.get("segments", {}).items():
+            index = int(index)
+            if index not in recording["segments"]:
+                recording["segments"][index] = get_worker_pool().submit(
+                    transcribe_segment, client, base64.b64decode(segment["data"]), segment["mime"], api_session()
+                )
+        if event.get("final_count") is not None:
+            recording["final_count"] = event["final_count"]
+
+    speech_settings = get_settings().get("speech_input", {})
+    with st.sidebar.container(border=True):
+        chunked_recorder(
+            recording=recording["id"],
+            acked=sorted(recording["segments"]),
+            min_seconds=speech_settings.get("min_segment_seconds", 3),
+            max_seconds=speech_settings.get("max_segment_seconds", 8),
+            key="chunked_recorder",
+            default=None,
+        )
+        partial_box = st.container()
+
+    if recording["id"] is None or recording["id"] == st.session_state.processed_audio:
+        return None
+
+    final_count = recording["final_count"]
+    if final_count is not None and len(recording["segments"]) >= final_count:
+        with trace("stt", segments=final_count, chunked=True):
+            transcript, seconds = timed(stitch_transcript, recording["segments"], wait=True)
+        st.session_state.processed_audio = recording["id"]
+        record_event("transcription", text=transcript, segments=final_count, seconds=round(seconds, 3))
+        return transcript or None
+
+    # Redrawn on a timer rather than on the rerun the next segment causes, so each
+    # segment's text shows up as soon as it has been transcribed
+    with partial_box:
+        st.fragment(show_partial_transcript, run_every=speech_settings.get("partial_refresh_seconds", 0.5))()
+    return None
+
+
 def main():
+    # One settings snapshot for the whole run
+    settings = get_settings()
     try:
         # Initialize session state first
-        init_session()
+        init_session(settings)
+        st.session_state.script_runs += 1
         
         # Inject CSS for custom styles
         local_css("style.css")
 
-        # Create API clients with error handling
+        # Pre-synthesize the scripted lines (runs once per server process)
+        try:
+            warm_audio_cache()
+        except Exception as e:
+            log.exception(f"Error starting audio cache warm-up: {e}")
+
+        # Continue a saved session when the student reconnects, possibly to another replica
+        restore_session()
+
+        # Pick up playback events from the browser before anything is drawn
+        handle_audio_events()
+
+        # Clips sent in earlier runs stay available until the player has fetched them
+        keep_clips()
+
+        # Get the shared API client with error handling
         try:
-            text_client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-            speech_client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+            text_client = speech_client = get_openai_client()
         except Exception as e:
             log.exception(f"Error creating API clients: {e}")
             st.error("Unable to connect to OpenAI API. Please check your API key.")
             return
 
         # Set page title from settings or use default
-        title = st.session_state.settings.get("title", "Columbia University School of Nursing: Implementing Flu Vaccination Program")
+        title = settings.get("title", "Columbia University School of Nursing: Implementing Flu Vaccination Program")
         st.title(title)
         
         # Setup sidebar (simplified version that doesn't rely on sidebar dictionary)
@@ -747,7 +3570,7 @@ def main():
         # Display intro text before Start Chat is pressed
         if st.session_state.show_intro:
             with st.container(border=True):
-                st.markdown(st.session_state.settings.get("intro", "Welcome to the simulation"))
+                st.markdown(settings.get("intro", "Welcome to the simulation"))
 
         # Check if chat is active
         if st.session_state.chat_active:
@@ -765,10 +3588,15 @@ def main():
             # Play debrief intro after transition (if needed)
             if "debrief_intro_needs_playing" in st.session_state and st.session_state.debrief_intro_needs_playing:
                 play_debrief_intro()
+
+            # Show and speak Noa's feedback once the intro is queued
+            if st.session_state.get("debrief_feedback_pending"):
+                deliver_debrief_feedback(speech_client)
             
-            # Show "Meet with Sam Richards" button when ready
+            # Show "Meet with Sam Richards" button when ready, but not while Noa hands over to Sam
             if (not st.session_state.sam_active and 
                 not st.session_state.debrief_active and 
+                not st.session_state.pending_transition and
                 "ready_for_sam" in st.session_state and 
                 st.session_state.ready_for_sam):
                 
@@ -778,7 +3606,7 @@ def main():
                              use_container_width=True,
                              help="Click to start your meeting with Sam Richards"):
                     # Direct transition to Sam using the simplified approach
-                    with st.chat_message("Public Health Nurse", avatar="assets/User.png"):
+                    with st.chat_message("Public Health Nurse", avatar=asset_source(USER_AVATAR)):
                         st.markdown("I'm ready to meet with Sam Richards now.")
                     
                     # Simulate a user query saying they're ready
@@ -801,7 +3629,10 @@ def main():
                     placeholder_text = "Chat with Noa to prepare for your meeting with Sam..."
                     
                 user_query = st.chat_input(placeholder_text)
-                transcript = handle_audio_input(speech_client)
+                if settings.get("speech_input", {}).get("mode", "chunked") == "chunked":
+                    transcript = handle_chunked_audio_input(speech_client)
+                else:
+                    transcript = handle_audio_input(speech_client)
                 if transcript:
                     user_query = transcript
 
@@ -817,7 +3648,7 @@ def main():
             if "sam_active" in st.session_state and st.session_state.sam_active and "debrief_active" in st.session_state and not st.session_state.debrief_active:
                 if st.button("End Session & Get Feedback", type="primary", use_container_width=True):
                     # Simulate a user query to end the session
-                    with st.chat_message("Public Health Nurse", avatar="assets/User.png"):
+                    with st.chat_message("Public Health Nurse", avatar=asset_source(USER_AVATAR)):
                         st.markdown("Ready for feedback on my conversation with Sam.")
                     
                     st.session_state.messages.append({"role": "user", "content": "Ready for feedback on my conversation with Sam."})
@@ -831,7 +3662,7 @@ def main():
                 show_download()
 
         # Show warning message in sidebar
-        warning_msg = st.session_state.settings.get("warning", "This is a simulation")
+        warning_msg = settings.get("warning", "This is a simulation")
         st.sidebar.warning(warning_msg)
         
     except Exception as e:
@@ -839,11 +3670,19 @@ def main():
         log.exception(f"Unhandled exception: {id}")
         
         # Get error message from settings or use default
-        error_msg = st.session_state.settings.get("error_message", 
+        error_msg = settings.get("error_message", 
                      "😞 Oops! An unexpected error occurred. Please try again. If the error persists, please contact the administrator.")
         
         st.error(f"{error_msg}\n\n**Reference id: {id}**")
 
 
 if __name__ == "__main__":
-    main()
+    if "admin" in st.query_params:
+        show_admin_page()
+    else:
+        with trace("rerun"), session_residency():
+            main()
+            # Save the turn so the session survives a restart or a move to another replica
+            checkpoint_session()
+            account_session()
+        trace_startup()
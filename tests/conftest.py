@@ -0,0 +1,67 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "streamlit.app.py")
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+from mock_openai import MockSettings, start_mock_server  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def app():
+    """streamlit.app.py loaded as a module, for testing its helpers without running the page"""
+    spec = importlib.util.spec_from_file_location("simulation_app", APP)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module  # Streamlit looks up the module that declares the components
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Scratch directory with the repository's settings.toml and assets to run the app in"""
+    with open(os.path.join(ROOT, "settings.toml"), encoding="utf-8") as f:
+        settings = f.read()
+    # A running app may hold the metrics port
+    settings = settings.replace("metrics_port = 8503", "metrics_port = 0")
+    (tmp_path / "settings.toml").write_text(settings, encoding="utf-8")
+    os.symlink(os.path.join(ROOT, "assets"), tmp_path / "assets")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def mock_openai(monkeypatch):
+    """tools/mock_openai.py with short latencies, used by the app instead of the OpenAI API"""
+    server, requests = start_mock_server(0, MockSettings(ttft=0.05, token_delay=0.001, tts_latency=0.01,
+                                                         tts_per_char=0, stt_latency=0.01, reply_words=20))
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}/v1")
+    yield requests
+    server.shutdown()
+
+
+@pytest.fixture
+def open_app(workdir, mock_openai):
+    """Opens the app in a new browser session, run up to the access code form"""
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    # Process-wide resources such as the API client and the stores belong to the previous test's
+    # mock server and directory
+    st.cache_resource.clear()
+
+    def open_app(**query_params):
+        at = AppTest.from_file(APP, default_timeout=60)
+        at.secrets["OPENAI_API_KEY"] = "sk-test"
+        at.secrets["password"] = "pw"
+        for name, value in query_params.items():
+            at.query_params[name] = value
+        at.run()
+        assert not at.exception, [e.message for e in at.exception]
+        return at
+
+    return open_app
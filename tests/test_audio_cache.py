@@ -0,0 +1,57 @@
+"""The on-disk TTS clip cache"""
+
+import os
+import time
+
+
+def test_round_trip_by_text_voice_and_model(app, tmp_path):
+    cache = app.AudioCache(str(tmp_path), 1000)
+    cache.put("Hello", "nova", "tts-1", b"clip")
+    assert cache.get("Hello", "nova", "tts-1") == b"clip"
+    assert cache.get("Hello", "onyx", "tts-1") is None
+    assert cache.get("Hello", "nova", "tts-1-hd") is None
+    assert cache.get("Hello!", "nova", "tts-1") is None
+
+
+def test_least_recently_used_clip_is_evicted(app, tmp_path):
+    cache = app.AudioCache(str(tmp_path), 25)
+    cache.put("a", "nova", "tts-1", b"x" * 10)
+    cache.put("b", "nova", "tts-1", b"x" * 10)
+    cache.get("a", "nova", "tts-1")  # "b" is now the least recently used
+    cache.put("c", "nova", "tts-1", b"x" * 10)
+    assert cache.get("b", "nova", "tts-1") is None
+    assert cache.get("a", "nova", "tts-1") == b"x" * 10
+    assert cache.get("c", "nova", "tts-1") == b"x" * 10
+    assert cache.total_bytes == 20
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_newest_clip_is_kept_even_if_too_large(app, tmp_path):
+    cache = app.AudioCache(str(tmp_path), 5)
+    cache.put("a", "nova", "tts-1", b"x" * 4)
+    cache.put("b", "nova", "tts-1", b"x" * 10)
+    assert cache.get("a", "nova", "tts-1") is None
+    assert cache.get("b", "nova", "tts-1") == b"x" * 10
+
+
+def test_reopened_cache_keeps_the_usage_order(app, tmp_path):
+    cache = app.AudioCache(str(tmp_path), 25)
+    cache.put("a", "nova", "tts-1", b"x" * 10)
+    time.sleep(0.01)
+    cache.put("b", "nova", "tts-1", b"x" * 10)
+    time.sleep(0.01)
+    cache.get("a", "nova", "tts-1")
+
+    reopened = app.AudioCache(str(tmp_path), 25)
+    assert reopened.total_bytes == 20
+    reopened.put("c", "nova", "tts-1", b"x" * 10)
+    assert reopened.get("b", "nova", "tts-1") is None
+    assert reopened.get("a", "nova", "tts-1") == b"x" * 10
+
+
+def test_missing_file_is_a_miss(app, tmp_path):
+    cache = app.AudioCache(str(tmp_path), 1000)
+    cache.put("a", "nova", "tts-1", b"clip")
+    os.remove(tmp_path / f"{cache.key('a', 'nova', 'tts-1')}.mp3")
+    assert cache.get("a", "nova", "tts-1") is None
+    assert cache.total_bytes == 0
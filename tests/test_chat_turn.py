@@ -0,0 +1,82 @@
+"""Hedging in ChatTurn, with fake providers instead of the chat APIs"""
+
+import time
+
+import pytest
+
+
+class FakeStream:
+    def close(self):
+        pass
+
+
+class FakeProvider:
+    """Sends its first token after ttft seconds, then one chunk every gap seconds"""
+
+    def __init__(self, name, ttft, chunks=1, gap=0.0):
+        self.name = name
+        self.ttft = ttft
+        self.chunks = chunks
+        self.gap = gap
+        self.opened = 0
+
+    def open(self, model, messages, temperature, max_tokens):
+        self.opened += 1
+        return FakeStream()
+
+    def events(self, stream):
+        time.sleep(self.ttft)
+        for i in range(self.chunks):
+            if i:
+                time.sleep(self.gap)
+            yield "text", f"{self.name}{i} "
+        yield "usage", {"prompt_tokens": 10, "cached_tokens": 0}
+
+
+class DirectScheduler:
+    def call(self, endpoint, model, request, session, tokens=0, on_wait=None):
+        return request()
+
+    def charge(self, endpoint, model, tokens):
+        pass
+
+
+@pytest.fixture
+def router(app, monkeypatch):
+    monkeypatch.setattr(app, "get_api_scheduler", DirectScheduler)
+
+    def make(openai, anthropic):
+        return app.ChatRouter({"openai": openai, "anthropic": anthropic})
+
+    return make
+
+
+ROUTES = [("openai", "gpt"), ("anthropic", "claude")]
+OPTIONS = {"hedge": True, "hedge_min_seconds": 0.3, "hedge_max_seconds": 0.3}
+
+
+def run_turn(router, openai, anthropic):
+    turn = router(openai, anthropic).stream(ROUTES, OPTIONS, [], 0.7, 100, "session")
+    text = "".join(value for kind, value in turn if kind == "text")
+    return turn, text
+
+
+def test_no_hedge_once_the_reply_is_streaming(router):
+    # First token well before the deadline, then the stream runs on past it
+    openai = FakeProvider("openai", ttft=0.05, chunks=6, gap=0.15)
+    anthropic = FakeProvider("anthropic", ttft=0.05)
+    turn, text = run_turn(router, openai, anthropic)
+    assert text.startswith("openai0") and "openai5" in text
+    assert len(turn.attempts) == 1
+    assert not turn.hedged
+    assert anthropic.opened == 0
+
+
+def test_hedges_when_the_first_token_is_late(router):
+    openai = FakeProvider("openai", ttft=2.0)
+    anthropic = FakeProvider("anthropic", ttft=0.05, chunks=2)
+    turn, text = run_turn(router, openai, anthropic)
+    assert turn.hedged
+    assert len(turn.attempts) == 2
+    assert turn.winner.provider is anthropic
+    assert text == "anthropic0 anthropic1 "
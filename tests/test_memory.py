@@ -0,0 +1,24 @@
+"""Per-session memory accounting"""
+
+import base64
+
+
+def test_footprint_includes_recorded_audio(app):
+    residency = app.SessionResidency()
+    segment = base64.b64encode(bytes(30000)).decode()
+    residency.parts = {
+        "messages": [{"role": "system", "content": "instruction"}, {"role": "user", "content": "hi"}],
+        "audio": {
+            "chunked_recorder": {"recording": "r1", "segments": {"0": {"data": segment, "mime": "audio/webm"}}},
+            "recorder": None,
+            "recorder_output": {"bytes": bytes(50000), "id": 3},
+        },
+    }
+    residency.measure()
+    assert residency.footprint["audio"] >= len(segment) + 50000
+    assert residency.total() == residency.footprint["messages"] + residency.footprint["audio"]
+
+
+def test_value_bytes(app):
+    assert app.value_bytes(None) == 0
+    assert app.value_bytes({"a": ["xy", b"z"], "b": 5}) == 3
@@ -0,0 +1,67 @@
+"""Fair token buckets for the shared rate limits"""
+
+import threading
+import time
+
+
+def test_full_quota_is_available_at_once(app):
+    bucket = app.FairTokenBucket(per_minute=600)
+    started = time.monotonic()
+    for _ in range(600):
+        bucket.acquire("a")
+    assert time.monotonic() - started < 0.5
+
+
+def test_empty_bucket_refills_at_the_per_minute_rate(app):
+    bucket = app.FairTokenBucket(per_minute=600, burst_seconds=0.1)  # 10 per second, one at a time
+    bucket.acquire("a")
+    started = time.monotonic()
+    for _ in range(3):
+        bucket.acquire("a")
+    assert 0.25 < time.monotonic() - started < 0.6
+
+
+def test_waiting_sessions_take_turns(app):
+    bucket = app.FairTokenBucket(per_minute=1200, burst_seconds=0.05)  # 20 per second, one at a time
+    bucket.pause(0.2)
+    served = []
+
+    def request(session):
+        bucket.acquire(session)
+        served.append(session)
+
+    threads = []
+    for session in ["a", "a", "a", "b"]:
+        threads.append(threading.Thread(target=request, args=(session,)))
+        threads[-1].start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join(timeout=5)
+    # "b" asked last but doesn't wait for all of "a"'s requests
+    assert served == ["a", "b", "a", "a"]
+
+
+def test_estimate_counts_other_sessions_queued_ahead(app):
+    bucket = app.FairTokenBucket(per_minute=60, burst_seconds=1)
+    bucket.acquire("a")
+    assert 0.5 < bucket.estimate_wait("a") <= 1.0
+    assert bucket.estimate_wait("a", cost=0) == 0.0
+
+
+def test_charge_settles_the_actual_cost(app):
+    bucket = app.FairTokenBucket(per_minute=6000)
+    bucket.acquire("a", cost=1000)
+    bucket.charge(3000)  # the reply was longer than the prompt estimate
+    assert bucket.tokens < 2100
+    bucket.charge(-2000)  # refund
+    assert 4000 <= bucket.tokens <= 4100
+    bucket.charge(-10000)
+    assert bucket.tokens == bucket.capacity
+
+
+def test_pause_holds_every_session(app):
+    bucket = app.FairTokenBucket(per_minute=6000)
+    bucket.pause(0.3)
+    started = time.monotonic()
+    bucket.acquire("b")
+    assert time.monotonic() - started >= 0.25
@@ -0,0 +1,36 @@
+"""Splitting a streamed reply into sentences for speech"""
+
+
+def test_complete_sentences_are_split_off(app):
+    sentences, rest = app.pop_sentences("I hear what you're saying. But we tried this before! And then")
+    assert sentences == ["I hear what you're saying.", "But we tried this before!"]
+    assert rest == "And then"
+
+
+def test_no_boundary_until_whitespace_follows(app):
+    # The stream may continue the sentence, e.g. "3." followed by "5 percent"
+    assert app.pop_sentences("Coverage went up by 3.") == ([], "Coverage went up by 3.")
+    assert app.pop_sentences("Coverage went up by 3.5 percent.") == ([], "Coverage went up by 3.5 percent.")
+
+
+def test_short_sentences_are_merged_with_the_next(app):
+    sentences, rest = app.pop_sentences("Look. I've been here fourteen years. Okay? ")
+    assert sentences == ["Look. I've been here fourteen years."]
+    assert rest == "Okay? "
+
+
+def test_closing_quotes_and_brackets_stay_with_the_sentence(app):
+    sentences, rest = app.pop_sentences('He said "we\'ll never do that here." (That was back in 2019.) Then')
+    assert sentences == ['He said "we\'ll never do that here."', "(That was back in 2019.)"]
+    assert rest == "Then"
+
+
+def test_streamed_chunks_give_the_same_sentences(app):
+    text = "Fine, I'll listen. What exactly do you need from my staff? I don't have people to spare. "
+    spoken, buffer = [], ""
+    for i in range(0, len(text), 7):
+        buffer += text[i:i + 7]
+        sentences, buffer = app.pop_sentences(buffer)
+        spoken += sentences
+    assert spoken == app.pop_sentences(text)[0]
+    assert buffer.strip() == ""
@@ -0,0 +1,52 @@
+"""A recorded session run end to end against tools/mock_openai.py"""
+
+import base64
+import glob
+import gzip
+import json
+import re
+
+import pytest
+
+
+@pytest.fixture
+def recording_workdir(workdir):
+    """settings.toml with recording on and whole-recording speech input"""
+    path = workdir / "settings.toml"
+    settings = path.read_text(encoding="utf-8")
+    settings = re.sub(r'(?m)^mode = "chunked"', 'mode = "whole"', settings)
+    settings = re.sub(r'(?m)^enabled = false\ndirectory = "recordings"', 'enabled = true\ndirectory = "recordings"', settings)
+    assert 'mode = "whole"' in settings and 'enabled = true\ndirectory = "recordings"' in settings
+    path.write_text(settings, encoding="utf-8")
+    return workdir
+
+
+def send(at, text):
+    at.chat_input[0].set_value(text).run()
+    assert not at.exception, [e.message for e in at.exception]
+
+
+def test_voice_input_then_debrief_is_recorded(recording_workdir, open_app):
+    at = open_app()
+    at.text_input(key="password").input("pw")
+    at.button[0].click().run()
+
+    # What the mic_recorder component sends after the student records a message
+    at.session_state["recorder"] = {"id": 1, "audio_base64": base64.b64encode(b"RIFF" + bytes(64)).decode(),
+                                    "sample_rate": 16000, "sample_width": 2, "format": "wav"}
+    at.run()
+    assert not at.exception, [e.message for e in at.exception]
+    assert at.session_state.processed_audio == 1
+
+    send(at, "yes let's go")
+    send(at, "Hello Sam, I want to talk about flu vaccines")
+    send(at, "Thank you for your time Sam, I'll send you the plan")
+    assert "debrief_draft" in at.session_state
+    send(at, "Ready for feedback")
+
+    [path] = glob.glob(str(recording_workdir / "recordings" / "*.jsonl.gz"))
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        kinds = [json.loads(line)["kind"] for line in f]
+    assert "transcription" in kinds
+    assert "draft" in kinds
+    assert "feedback" in kinds
@@ -0,0 +1,43 @@
+"""Checkpointing sessions and restoring them from the page URL"""
+
+
+def send(at, text):
+    at.chat_input[0].set_value(text).run()
+    assert not at.exception, [e.message for e in at.exception]
+
+
+def log_in(at, password="pw"):
+    at.text_input(key="password").input(password)
+    at.button[0].click().run()
+    assert not at.exception, [e.message for e in at.exception]
+
+
+def test_session_link_needs_the_access_code(open_app):
+    first = open_app()
+    log_in(first)
+    send(first, "I think security will be their main worry")
+    sid = first.query_params["sid"]
+    messages = first.session_state.messages
+
+    other = open_app(sid=sid)
+    assert "password_correct" not in other.session_state
+    assert not other.chat_input
+    assert len(other.session_state.messages) == 1  # only the system message
+    assert other.query_params["sid"] == sid
+
+    log_in(other, "wrong")
+    assert len(other.session_state.messages) == 1
+
+    log_in(other)
+    assert other.session_state.messages == messages
+    assert other.session_state.checkpoint["key"] == sid
+    assert not other.session_state.welcome_audio_needs_playing
+
+
+def test_access_code_is_not_saved(app, open_app):
+    at = open_app()
+    log_in(at)
+    send(at, "Hello Noa")
+    _, state = app.get_session_store().load(at.query_params["sid"])
+    assert "password_correct" not in state
+    assert len(state["messages"]) == len(at.session_state.messages)
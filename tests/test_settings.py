@@ -0,0 +1,72 @@
+"""Validation and reloading of settings.toml"""
+
+import os
+
+import pytest
+
+
+def test_missing_and_invalid_values_fall_back_to_defaults(app):
+    settings = {"parameters": {"model": "gpt-4o", "temperature": 3, "worker_threads": True, "extra": 1}}
+    problems = app.validate_section(settings, "parameters", app.DEFAULT_PARAMETERS, app.PARAMETER_CHECKS)
+    checked = settings["parameters"]
+    assert checked["model"] == "gpt-4o"
+    assert checked["temperature"] == app.DEFAULT_PARAMETERS["temperature"]
+    assert checked["worker_threads"] == app.DEFAULT_PARAMETERS["worker_threads"]
+    assert checked["tts_threads"] == app.DEFAULT_PARAMETERS["tts_threads"]
+    assert checked["extra"] == 1  # keys without a check are kept as they are
+    assert any("temperature = 3 is invalid" in problem for problem in problems)
+    assert any("tts_threads is missing" in problem for problem in problems)
+    assert not any("model" in problem for problem in problems)
+
+
+def test_missing_section_is_filled_in(app):
+    settings = {}
+    problems = app.validate_section(settings, "display", app.DEFAULT_DISPLAY, app.DISPLAY_CHECKS)
+    assert settings["display"] == app.DEFAULT_DISPLAY
+    assert problems[0] == "[display] is missing"
+
+
+@pytest.mark.parametrize("value", [0, -3, 2.5, "12", True])
+def test_invalid_visible_messages(app, value):
+    settings = {"display": {"visible_messages": value}}
+    assert app.validate_section(settings, "display", app.DEFAULT_DISPLAY, app.DISPLAY_CHECKS)
+    assert settings["display"]["visible_messages"] == app.DEFAULT_DISPLAY["visible_messages"]
+
+
+def test_agent_avatar_must_exist(app):
+    settings = {"sam": {"name": "Sam", "avatar": "assets/missing.jpg", "voice": "onyx"}}
+    app.validate_section(settings, "sam", app.DEFAULT_AGENTS["sam"], app.AGENT_CHECKS)
+    assert settings["sam"]["avatar"] == app.DEFAULT_AGENTS["sam"]["avatar"]
+    assert settings["sam"]["name"] == "Sam"
+
+
+def test_snapshot_is_read_only(app):
+    snapshot = app.checked_settings({"title": "t", "memory": {"limits": [1, 2]}})
+    with pytest.raises(TypeError):
+        snapshot["title"] = "changed"
+    with pytest.raises(TypeError):
+        snapshot["parameters"]["temperature"] = 1
+    assert snapshot["memory"]["limits"] == (1, 2)
+
+
+def test_restart_settings_changed(app):
+    old = {"logging": {"level": "INFO"}, "providers": {"window": 50, "hedge": True}, "parameters": {"tts_threads": 8}}
+    new = {"logging": {"level": "DEBUG"}, "providers": {"window": 50, "hedge": False}, "parameters": {"tts_threads": 4}}
+    assert app.restart_settings_changed(old, new) == ["[logging]", "[parameters] tts_threads"]
+    assert app.restart_settings_changed(old, old) == []
+
+
+def test_store_reloads_an_edited_file_and_keeps_the_last_good_one(app, tmp_path):
+    path = tmp_path / "settings.toml"
+    path.write_text('title = "first"\n')
+    store = app.SettingsStore(str(path), check_interval=0)
+    assert store.get()["title"] == "first"
+    assert store.get() is store.get()  # unchanged file, same snapshot
+
+    path.write_text('title = "second"\n')
+    os.utime(path, ns=(1, 10**18))
+    assert store.get()["title"] == "second"
+
+    path.write_text('title = "unterminated\n')
+    os.utime(path, ns=(1, 2 * 10**18))
+    assert store.get()["title"] == "second"
@@ -0,0 +1,50 @@
+"""Phase transition signals, matched as whole words"""
+
+import pytest
+
+
+@pytest.mark.parametrize("text", ["I'm ready", "READY!", "Ready, let's do it.", "ok", "Sure thing", "(yes)"])
+def test_ready_signals(app, text):
+    assert "ready" in app.find_signals(text)
+    assert app.next_phase("prebrief", text) == "sam"
+
+
+@pytest.mark.parametrize("text", [
+    "I already told you",  # "ready" inside "already"
+    "What's the background here?",  # "go" inside "background"
+    "That's a bit of a stretch",
+    "The okapi is an animal",  # "ok" inside "okapi"
+    "Yesterday was long",  # "yes" inside "yesterday"
+])
+def test_no_signals_inside_words(app, text):
+    assert "ready" not in app.find_signals(text)
+    assert app.next_phase("prebrief", text) is None
+
+
+def test_phrases_tolerate_whitespace_case_and_apostrophes(app):
+    assert "ready" in app.find_signals("LETS go")
+    assert "ready" in app.find_signals("let’s meet")
+    assert "ready" in app.find_signals("can I   meet\nwith   Sam now")
+    assert "wind_down" in app.find_signals("Thank you for your time, Sam.")
+    assert "wind_down" in app.find_signals("Ill send you the plan")
+
+
+def test_overlapping_signals_are_all_found(app):
+    # "ready" is a prefix of "ready for feedback" and "ready to meet"
+    assert app.find_signals("I'm ready for feedback") >= {"ready", "feedback"}
+    assert app.find_signals("Are you ready to meet Sam?") >= {"ready", "invitation"}
+    assert app.find_signals("Thanks for your time, I'm ready for feedback") >= {"wind_down", "feedback"}
+
+
+def test_next_phase_uses_the_signal_of_the_current_phase(app):
+    assert app.next_phase("sam", "I'm ready for feedback") == "debrief"
+    assert app.next_phase("sam", "I'm ready") is None
+    assert app.next_phase("prebrief", "end session") is None
+    assert app.next_phase("debrief", "yes, ready for feedback") is None
+
+
+def test_compile_signals(app):
+    matcher = app.compile_signals({"a": ["cat"], "b": ["cat food", "dog"]})
+    found = [{name for name, value in m.groupdict().items() if value} for m in matcher.finditer("Cat food for the dog")]
+    assert [names for names in found if names] == [{"a", "b"}, {"b"}]
+    assert not any(any(m.groupdict().values()) for m in matcher.finditer("concatenate hotdogs"))
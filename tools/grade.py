@@ -0,0 +1,240 @@
+"""Grade a cohort's transcripts offline with the debrief instruction from settings.toml.
+
+Each transcript is a conversation in the app's message format: the list of
+{"role", "content", "agent"} dicts kept in st.session_state.messages, as saved
+by the JSON transcript download. Inputs can be .json files holding one
+transcript (a list of messages, or an object with a "messages" list), .jsonl
+files with one transcript per line, directories of either, or the app's
+sessions.db. For every transcript, the conversation up to the end of the
+meeting with Sam is sent to the chat model with Noa's instruction, followed by
+the student asking for feedback, and Noa's debrief is written to the output file.
+
+Requests run on a bounded worker pool. Every result is appended to the output
+file as soon as it arrives, so an interrupted run resumes where it stopped when
+started again with the same output file. Identical requests, such as a
+transcript exported twice or one already graded under the same instruction,
+are sent only once. After a rubric change in settings.toml, every request
+changes, so the whole cohort is graded again.
+
+Usage (from the repository root):
+
+    python tools/grade.py transcripts/ --out grades.jsonl --workers 8
+    python tools/grade.py --sessions-db sessions.db --out grades.jsonl
+
+The OpenAI key is read from OPENAI_API_KEY or .streamlit/secrets.toml. To try
+it against the local mock server:
+
+    python tools/mock_openai.py --port 8765 &
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=sk-mock python tools/grade.py transcripts/
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import tomllib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from openai import OpenAI
+
+# The message that starts the debrief in the app
+FEEDBACK_REQUEST = "Ready for feedback on my conversation with Sam."
+
+
+def load_transcripts(paths, sessions_db=None):
+    """Yield (id, messages) for every transcript in the given files, directories and session store"""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith((".json", ".jsonl")):
+                    yield from load_transcripts([os.path.join(path, name)])
+        elif path.endswith(".jsonl"):
+            with open(path, encoding="utf-8") as f:
+                for number, line in enumerate(f, 1):
+                    if line.strip():
+                        yield f"{path}:{number}", transcript_messages(json.loads(line))
+        else:
+            with open(path, encoding="utf-8") as f:
+                yield path, transcript_messages(json.load(f))
+    if sessions_db:
+        db = sqlite3.connect(f"file:{sessions_db}?mode=ro", uri=True)
+        try:
+            for key, state in db.execute("SELECT key, state FROM sessions ORDER BY updated"):
+                yield f"{sessions_db}:{key}", transcript_messages(json.loads(state))
+        finally:
+            db.close()
+
+
+def transcript_messages(data):
+    """The message list of a transcript saved as a list or inside a session snapshot"""
+    return data["messages"] if isinstance(data, dict) else data
+
+
+def debrief_messages(messages, instruction):
+    """The request messages that have Noa debrief the meeting with Sam, or None if there was no meeting.
+
+    Everything from the student's first request for feedback onwards is left
+    out, so an earlier debrief doesn't colour the new one.
+    """
+    turns = [m for m in messages if m["role"] != "system"]
+    met_sam = False
+    end = len(turns)
+    for i, message in enumerate(turns):
+        if message["role"] == "assistant" and message.get("agent") == "sam":
+            met_sam = True
+        elif met_sam and message["role"] == "assistant" and message.get("agent") == "noa":
+            # Noa speaks again after Sam: the debrief began with the student's message before this
+            end = i - 1 if i and turns[i - 1]["role"] == "user" else i
+            break
+    if not met_sam:
+        return None
+    return (
+        [{"role": "system", "content": instruction}]
+        + [{"role": m["role"], "content": m["content"]} for m in turns[:end]]
+        + [{"role": "user", "content": FEEDBACK_REQUEST}]
+    )
+
+
+def request_key(request):
+    """Hash of a chat request; identical requests share a key and are sent once"""
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+
+def load_checkpoint(path):
+    """Results already in the output file: successful feedback by request key, and graded transcript ids"""
+    done, graded = {}, set()
+    if not os.path.exists(path):
+        return done, graded
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # cut off by an interrupted run
+            if result.get("status") == "ok":
+                done[result["key"]] = result
+                graded.add((result["transcript"], result["key"]))
+    return done, graded
+
+
+def grade(client, request):
+    """Send one grading request and return its result fields"""
+    started = time.time()
+    response = client.chat.completions.create(**request)
+    usage = response.usage
+    details = usage.prompt_tokens_details if usage else None
+    return {
+        "feedback": response.choices[0].message.content,
+        "prompt_tokens": usage.prompt_tokens if usage else None,
+        "cached_tokens": (details.cached_tokens or 0) if details else None,
+        "completion_tokens": usage.completion_tokens if usage else None,
+        "seconds": round(time.time() - started, 3),
+    }
+
+
+def api_key():
+    if os.environ.get("OPENAI_API_KEY"):
+        return os.environ["OPENAI_API_KEY"]
+    try:
+        with open(os.path.join(".streamlit", "secrets.toml"), "rb") as f:
+            return tomllib.load(f)["OPENAI_API_KEY"]
+    except (OSError, KeyError):
+        sys.exit("Set OPENAI_API_KEY or add it to .streamlit/secrets.toml")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("paths", nargs="*", help="transcript .json/.jsonl files or directories")
+    parser.add_argument("--sessions-db", help="also grade the sessions saved in this session store")
+    parser.add_argument("--out", default="grades.jsonl", help="JSON Lines results file, resumed if it exists")
+    parser.add_argument("--settings", default="settings.toml")
+    parser.add_argument("--instruction", default="noa_instruction",
+                        help="settings.toml key of the instruction used for the debrief")
+    parser.add_argument("--model", help="chat model, default [parameters] model")
+    parser.add_argument("--workers", type=int, default=8, help="requests in flight at once")
+    parser.add_argument("--max-retries", type=int, default=5, help="retries of rate limits and server errors")
+    args = parser.parse_args()
+    if not args.paths and not args.sessions_db:
+        parser.error("give transcript paths or --sessions-db")
+
+    with open(args.settings, "rb") as f:
+        settings = tomllib.load(f)
+    parameters = settings.get("parameters", {})
+    instruction = settings[args.instruction]
+    done, graded = load_checkpoint(args.out)
+
+    # Group the transcripts by request, so each distinct request is sent once
+    requests, transcripts = {}, {}
+    skipped = reused = 0
+    for transcript, messages in load_transcripts(args.paths, args.sessions_db):
+        prompt = debrief_messages(messages, instruction)
+        if prompt is None:
+            print(f"Skipping {transcript}: no conversation with Sam", file=sys.stderr)
+            skipped += 1
+            continue
+        request = {
+            "model": args.model or parameters.get("model", "gpt-4o"),
+            "temperature": parameters.get("temperature", 0.7),
+            "max_tokens": 800,
+            "messages": prompt,
+            # Every request starts with the same instruction, which the API caches when they share a key
+            "prompt_cache_key": "debrief-" + hashlib.sha256(instruction.encode("utf-8")).hexdigest()[:16],
+        }
+        key = request_key(request)
+        if (transcript, key) in graded:
+            continue
+        requests[key] = request
+        transcripts.setdefault(key, []).append(transcript)
+
+    client = OpenAI(api_key=api_key(), max_retries=args.max_retries)
+    out_lock = threading.Lock()
+    total = sum(len(ids) for ids in transcripts.values())
+    finished = failed = 0
+
+    with open(args.out, "a", encoding="utf-8") as out:
+
+        def write(key, transcript, result):
+            with out_lock:
+                out.write(json.dumps({"transcript": transcript, "key": key, **result}) + "\n")
+                out.flush()
+
+        # Requests graded by an earlier run are written for the new transcripts without calling the API
+        for key in [key for key in transcripts if key in done]:
+            cached = {k: v for k, v in done[key].items() if k not in ("transcript", "key")}
+            for transcript in transcripts.pop(key):
+                write(key, transcript, dict(cached, reused=True))
+                reused += 1
+
+        executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="grade")
+        futures = {executor.submit(grade, client, requests[key]): key for key in transcripts}
+        try:
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    result = dict(future.result(), status="ok", model=requests[key]["model"])
+                except Exception as e:
+                    result = {"status": "error", "error": repr(e)}
+                    failed += len(transcripts[key])
+                for transcript in transcripts[key]:
+                    write(key, transcript, result)
+                finished += len(transcripts[key])
+                print(f"\r{finished}/{total} graded", end="", file=sys.stderr, flush=True)
+        except KeyboardInterrupt:
+            print("\nInterrupted; run again with the same --out to resume", file=sys.stderr)
+            executor.shutdown(wait=False, cancel_futures=True)
+            sys.exit(130)
+        executor.shutdown()
+
+    print(file=sys.stderr)
+    print(f"{finished - failed + reused} graded ({len(futures)} requests sent, {reused} reused from {args.out}), "
+          f"{failed} failed, {skipped} skipped")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""Load test: run many simulated students through the real app at once.
+
+Each simulated session drives streamlit.app.py headlessly with Streamlit's
+AppTest. It follows the full flow: password login, a pre-brief question to
+Noa, the transition, several turns with Sam, the debrief and a follow-up
+question. All OpenAI traffic goes to the local mock server from
+mock_openai.py, so runs are free and repeatable. With --anthropic-ttft, a mock
+Anthropic server from mock_anthropic.py is started too, so chat routing and
+hedged requests between the two providers can be exercised. For each concurrency level
+the report shows:
+
+- time to first token: from submitting a message to the mock sending the first token
+- TTS latency: from submitting a message to the first speech clip of the reply being ready
+- script-thread occupancy: how long each script run kept a Streamlit script thread busy
+- memory: process RSS growth per session
+
+Usage (from the repository root):
+
+    python tools/loadtest.py --sessions 50,100,200 --ttft 0.6 --token-delay 0.03
+    python tools/loadtest.py --sessions 20 --ttft 3 --anthropic-ttft 0.5
+"""
+
+import argparse
+import ast
+import json
+import os
+import sys
+import threading
+import time
+
+from mock_anthropic import start_mock_anthropic_server
+from mock_openai import RequestLog, add_latency_arguments, latency_settings, start_mock_server
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit.app.py")
+PASSWORD = "loadtest"
+
+PREBRIEF = ["What do you think Sam will push back on first?"]
+SAM_TURNS = [
+    "Hi Sam, thanks for meeting with me. I'd like to talk about offering flu shots here.",
+    "We can run the clinic in the housing units so nobody has to move through the facility.",
+    "The county covers the vaccine and our nurses, so there's no cost to your budget.",
+]
+DEBRIEF = ["What could I have done better with the staffing concern?"]
+
+
+def make_app_test_thread_safe(anthropic=False):
+    """Let many AppTest sessions run at once in one process.
+
+    AppTest is written for one test at a time: every run installs a mock
+    Streamlit runtime and the test's secrets globally and removes them at the
+    end, which breaks sessions running in parallel. Install one shared runtime
+    and one set of secrets for the whole load test instead, the way a real
+    server has one runtime for all sessions. Also serialize ast.parse, which
+    isn't thread-safe on Python 3.11 and runs at the start of every script run.
+    """
+    from unittest.mock import MagicMock
+
+    import streamlit as st
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.testing.v1 import app_test
+
+    # Build the shared runtime the same way AppTest builds its per-run one
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = app_test.MediaFileManager(app_test.MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = app_test.MemoryCacheStorageManager()
+    if hasattr(app_test, "DataframeSourceManager"):
+        runtime.dataframe_source_mgr = app_test.DataframeSourceManager()
+    if hasattr(app_test, "BidiComponentManager"):
+        runtime.bidi_component_registry = app_test.BidiComponentManager()
+        runtime.bidi_component_registry.discover_and_register_components(start_file_watching=False)
+    Runtime._instance = runtime
+    # AppTest assigns its per-run mock to this subclass, leaving the shared one in place
+    app_test.Runtime = type("PerTestRuntime", (Runtime,), {})
+
+    secrets = Secrets()
+    secrets._secrets = {"OPENAI_API_KEY": "sk-loadtest", "password": PASSWORD}
+    if anthropic:
+        secrets._secrets["ANTHROPIC_API_KEY"] = "sk-ant-loadtest"
+    st.secrets = secrets
+
+    parse_lock = threading.Lock()
+    parse = ast.parse
+
+    def locked_parse(*args, **kwargs):
+        with parse_lock:
+            return parse(*args, **kwargs)
+
+    ast.parse = locked_parse
+
+
+def rss_bytes():
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+class CombinedLog(RequestLog):
+    """Request logs of several mock servers read as one"""
+
+    def __init__(self, *logs):
+        self.logs = logs
+
+    def snapshot(self):
+        return [entry for log in self.logs for entry in log.snapshot()]
+
+    def clear(self):
+        for log in self.logs:
+            log.clear()
+
+
+class SimulatedSession:
+    """One student going through the simulation via AppTest"""
+
+    def __init__(self, number, timeout):
+        from streamlit.testing.v1 import AppTest
+
+        self.number = number
+        self.app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.turn_starts = {}  # tag -> time the message was submitted
+        self.run_seconds = []  # wall time of each script run
+        self.error = None
+
+    def run(self, action=None):
+        started = time.time()
+        (action or self.app).run()
+        self.run_seconds.append(time.time() - started)
+        if self.app.exception:
+            raise RuntimeError(self.app.exception[0].message)
+
+    def say(self, text):
+        tag = f"[lt-{self.number}-{len(self.turn_starts)}]"
+        self.turn_starts[tag] = time.time()
+        self.run(self.app.chat_input[0].set_value(f"{text} {tag}"))
+
+    def go(self):
+        try:
+            self.run()
+            self.app.text_input(key="password").input(PASSWORD)
+            self.run(self.app.button[0].click())
+            for text in PREBRIEF:
+                self.say(text)
+            self.run(self.app.chat_input[0].set_value("Yes, I'm ready to meet Sam."))
+            for text in SAM_TURNS:
+                self.say(text)
+            self.run(self.app.chat_input[0].set_value("Ready for feedback"))
+            for text in DEBRIEF:
+                self.say(text)
+        except Exception as e:
+            self.error = repr(e)
+
+
+def run_level(sessions, requests, timeout):
+    """Run the given number of sessions concurrently and return their metrics"""
+    requests.clear()
+    rss_before = rss_bytes()
+    started = time.time()
+    simulated = [SimulatedSession(n, timeout) for n in range(sessions)]
+    threads = [threading.Thread(target=s.go, name=f"session-{s.number}") for s in simulated]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.time() - started
+    rss_after = rss_bytes()
+
+    turn_starts = {tag: t for s in simulated for tag, t in s.turn_starts.items()}
+    log = requests.snapshot()
+    hedged = {}
+    for e in log:
+        if e["endpoint"] == "chat" and e["tag"]:
+            hedged[e["tag"]] = hedged.get(e["tag"], 0) + 1
+    ttft = [e["first_token"] - turn_starts[e["tag"]] for e in log
+            if e["endpoint"] == "chat" and e["stream"] and not e.get("cancelled") and e["tag"] in turn_starts]
+    first_speech = {}
+    for e in log:
+        if e["endpoint"] == "speech" and e["tag"] in turn_starts:
+            first_speech[e["tag"]] = min(first_speech.get(e["tag"], e["finished"]), e["finished"])
+    tts = [finished - turn_starts[tag] for tag, finished in first_speech.items()]
+    runs = [seconds for s in simulated for seconds in s.run_seconds]
+    errors = [s.error for s in simulated if s.error]
+
+    return {
+        "sessions": sessions,
+        "wall_seconds": round(wall, 2),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "ttft_p50": percentile(ttft, 0.5),
+        "ttft_p95": percentile(ttft, 0.95),
+        "tts_p50": percentile(tts, 0.5),
+        "tts_p95": percentile(tts, 0.95),
+        "script_runs": len(runs),
+        "script_run_p50": percentile(runs, 0.5),
+        "script_run_p95": percentile(runs, 0.95),
+        # Average number of script threads busy at any moment during the level
+        "busy_script_threads": round(sum(runs) / wall, 1) if wall else None,
+        "api_calls": {endpoint: sum(1 for e in log if e["endpoint"] == endpoint)
+                      for endpoint in ("chat", "speech", "transcription")},
+        "anthropic_chat_calls": sum(1 for e in log if e.get("provider") == "anthropic"),
+        "hedged_turns": sum(1 for count in hedged.values() if count > 1),
+        "rss_per_session_kb": round((rss_after - rss_before) / sessions / 1024, 1),
+    }
+
+
+def print_report(results):
+    def seconds(value):
+        return "-" if value is None else f"{value:.2f}s"
+
+    print(f"{'sessions':>8} {'errors':>6} {'TTFT p50/p95':>15} {'TTS p50/p95':>15} "
+          f"{'run p50/p95':>15} {'busy thr':>8} {'KB/sess':>8}")
+    for r in results:
+        print(f"{r['sessions']:>8} {r['errors']:>6} "
+              f"{seconds(r['ttft_p50']):>7}/{seconds(r['ttft_p95']):<7} "
+              f"{seconds(r['tts_p50']):>7}/{seconds(r['tts_p95']):<7} "
+              f"{seconds(r['script_run_p50']):>7}/{seconds(r['script_run_p95']):<7} "
+              f"{r['busy_script_threads']:>8} {r['rss_per_session_kb']:>8}")
+        if r["anthropic_chat_calls"] or r["hedged_turns"]:
+            print(f"         chat: {r['api_calls']['chat']} requests, {r['anthropic_chat_calls']} to Anthropic, "
+                  f"{r['hedged_turns']} hedged turns")
+        if r["first_error"]:
+            print(f"         first error: {r['first_error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", default="50,100,200",
+                        help="comma-separated concurrency levels")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds allowed per script run")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--anthropic-ttft", type=float,
+                        help="also start a mock Anthropic server with this time to first token")
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    server, requests = start_mock_server(0, latency_settings(args))
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    servers = [server]
+    if args.anthropic_ttft is not None:
+        settings = latency_settings(args)
+        settings.ttft = args.anthropic_ttft
+        anthropic_server, anthropic_requests = start_mock_anthropic_server(0, settings)
+        os.environ["ANTHROPIC_BASE_URL"] = f"http://127.0.0.1:{anthropic_server.server_address[1]}"
+        servers.append(anthropic_server)
+        requests = CombinedLog(requests, anthropic_requests)
+    # The app reads settings.toml and assets/ relative to the working directory
+    os.chdir(os.path.dirname(APP_PATH))
+    make_app_test_thread_safe(anthropic=args.anthropic_ttft is not None)
+
+    # One session first so imports, caches and connection pools don't count against the first level
+    print("Warming up...", file=sys.stderr)
+    run_level(1, requests, args.timeout)
+
+    results = []
+    for sessions in [int(n) for n in args.sessions.split(",")]:
+        print(f"Running {sessions} concurrent sessions...", file=sys.stderr)
+        results.append(run_level(sessions, requests, args.timeout))
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    for server in servers:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Local stand-in for the Anthropic Messages API the simulation can route chat to.
+
+Serves streaming and non-streaming /v1/messages with the same configurable
+latency and replies as mock_openai.py, so routing between providers and hedged
+requests can be tried without network access or API cost. Point the app at it
+with the ANTHROPIC_BASE_URL environment variable and give it any
+ANTHROPIC_API_KEY in the app secrets:
+
+    python tools/mock_anthropic.py --port 8766 --ttft 0.4
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8766 streamlit run streamlit.app.py
+
+Prompt caching follows the explicit cache_control breakpoints of the request:
+prefixes ending at a breakpoint are written to the cache, and usage reports the
+tokens read from and written to it.
+
+Requests are logged with endpoint "chat" and provider "anthropic", so the load
+test counts them together with the OpenAI chat requests.
+"""
+
+import argparse
+import json
+import threading
+import time
+
+from mock_openai import (
+    TAG_PATTERN,
+    MockOpenAIHandler,
+    add_latency_arguments,
+    latency_settings,
+    reply_tokens,
+    start_mock_server,
+)
+
+
+class MockAnthropicHandler(MockOpenAIHandler):
+
+    def do_GET(self):
+        self.send_json({"type": "error", "error": {"type": "not_found_error", "message": "Not found"}}, status=404)
+
+    def do_POST(self):
+        started = time.time()
+        body = self.read_body()
+        if self.path.rstrip("/").endswith("/messages"):
+            self.messages(json.loads(body), started)
+        else:
+            self.send_json({"type": "error", "error": {"type": "not_found_error", "message": "Not found"}},
+                           status=404)
+
+    def messages(self, request, started):
+        system = request.get("system", "")
+        blocks = [{"type": "text", "text": system}] if isinstance(system, str) else system
+        breakpoints = [bool(block.get("cache_control")) for block in blocks]
+        messages = []
+        for m in request["messages"]:
+            content = [{"type": "text", "text": m["content"]}] if isinstance(m["content"], str) else m["content"]
+            blocks += content
+            breakpoints += [bool(block.get("cache_control")) for block in content]
+            messages.append({"role": m["role"], "content": "".join(block["text"] for block in content)})
+        tokens = reply_tokens(messages, self.settings.reply_words)
+        parts = [block["text"] for block in blocks]
+        prompt_chars = sum(len(part) for part in parts)
+
+        store_at = [i for i, marked in enumerate(breakpoints) if marked]
+        cached, total = self.prompt_cache.match(parts, store_at)
+        # Everything up to the last breakpoint that wasn't read from the cache is written to it
+        cacheable = sum(len(part) // 4 + 4 for part in parts[:store_at[-1] + 1]) if store_at else 0
+        written = max(0, cacheable - cached) if cacheable >= 1024 else 0
+        usage = {"input_tokens": total - cached - written, "output_tokens": len(tokens),
+                 "cache_read_input_tokens": cached, "cache_creation_input_tokens": written}
+        tag = TAG_PATTERN.match(tokens[0])
+        message = {"id": "msg_mock", "type": "message", "role": "assistant", "model": request["model"],
+                   "stop_reason": None, "stop_sequence": None}
+
+        time.sleep(self.settings.ttft)
+        if not request.get("stream"):
+            self.send_json(dict(message, stop_reason="end_turn", usage=usage,
+                                content=[{"type": "text", "text": "".join(tokens).strip()}]))
+            self.requests.add(endpoint="chat", provider="anthropic", tag=tag and tag.group(0), stream=False,
+                              started=started, first_token=time.time(), finished=time.time(),
+                              prompt_chars=prompt_chars)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        first_token = None
+        try:
+            self.send_named_event("message_start", {"type": "message_start", "message": dict(
+                message, content=[], usage=dict(usage, output_tokens=1))})
+            self.send_named_event("content_block_start", {"type": "content_block_start", "index": 0,
+                                                    "content_block": {"type": "text", "text": ""}})
+            for token in tokens:
+                self.send_named_event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                        "delta": {"type": "text_delta", "text": token}})
+                first_token = first_token or time.time()
+                time.sleep(self.settings.token_delay)
+            self.send_named_event("content_block_stop", {"type": "content_block_stop", "index": 0})
+            self.send_named_event("message_delta", {"type": "message_delta",
+                                              "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                              "usage": {"output_tokens": len(tokens)}})
+            self.send_named_event("message_stop", {"type": "message_stop"})
+            self.send_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+            self.requests.add(endpoint="chat", provider="anthropic", tag=tag and tag.group(0), stream=True,
+                              started=started, first_token=first_token, finished=time.time(), cancelled=True,
+                              prompt_chars=prompt_chars)
+            return
+        self.requests.add(endpoint="chat", provider="anthropic", tag=tag and tag.group(0), stream=True,
+                          started=started, first_token=first_token, finished=time.time(),
+                          prompt_chars=prompt_chars)
+
+    def send_named_event(self, name, payload):
+        self.send_chunk(f"event: {name}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+
+def start_mock_anthropic_server(port=0, settings=None):
+    """Start the mock server on a background thread and return (server, request log)"""
+    return start_mock_server(port, settings, MockAnthropicHandler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8766)
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+    server, _ = start_mock_anthropic_server(args.port, latency_settings(args))
+    print(f"Mock Anthropic server on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
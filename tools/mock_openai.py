@@ -0,0 +1,273 @@
+"""Local stand-in for the OpenAI endpoints the simulation uses.
+
+Serves chat completions (streaming and not), text-to-speech, Whisper
+transcriptions and the model list with configurable latency, so the app can be
+load tested or replayed without network access or API cost. Point the app at it
+with the OPENAI_BASE_URL environment variable:
+
+    python tools/mock_openai.py --port 8765 --ttft 0.6 --token-delay 0.03
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 streamlit run streamlit.app.py
+
+Usage reports cached prompt tokens the way the API does: the longest prefix of
+1024 tokens or more that an earlier request started with is counted as cached.
+
+If the last user message contains a tag like [lt-3-2], the reply starts with the
+same tag. Speech requests for that reply then carry it too, which lets the load
+test match every request to a session and turn.
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TAG_PATTERN = re.compile(r"\[lt-[\w-]+\]")
+
+REPLY = (
+    "Look, I hear what you're saying, but you have to understand how things work here. "
+    "I've got two exam rooms, a staff that's already stretched thin, and every inmate "
+    "movement needs an escort. Where exactly are the officers for this supposed to come from? "
+    "And who signs off on the liability if somebody has a reaction? "
+    "Walk me through how this would actually run on a Tuesday morning."
+)
+
+
+class MockSettings:
+    """Latency profile of the mock server"""
+
+    def __init__(self, ttft=0.5, token_delay=0.02, tts_latency=0.3, tts_per_char=0.002,
+                 stt_latency=0.3, reply_words=80):
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.tts_latency = tts_latency
+        self.tts_per_char = tts_per_char
+        self.stt_latency = stt_latency
+        self.reply_words = reply_words
+
+
+class RequestLog:
+    """Thread-safe record of every request the mock server handled"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = []
+
+    def add(self, **entry):
+        with self.lock:
+            self.entries.append(entry)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class PromptCache:
+    """Prefixes of earlier prompts, to report cached tokens like the real APIs"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seen = set()
+
+    def match(self, parts, store_at=None, min_tokens=1024):
+        """Return (cached tokens, total tokens) of a prompt made of parts.
+
+        The cached tokens are those of the longest prefix of whole parts seen
+        before. Afterwards the prefixes ending at the parts in store_at (all
+        by default) are remembered, if they are at least min_tokens long.
+        """
+        digest = hashlib.sha256()
+        hashes, tokens, total = [], [], 0
+        for part in parts:
+            digest.update(part.encode("utf-8"))
+            hashes.append(digest.hexdigest())
+            total += len(part) // 4 + 4
+            tokens.append(total)
+        with self.lock:
+            cached = max((tokens[i] for i, h in enumerate(hashes) if h in self.seen), default=0)
+            for i in range(len(parts)) if store_at is None else store_at:
+                if tokens[i] >= min_tokens:
+                    self.seen.add(hashes[i])
+        return cached, total
+
+
+def reply_tokens(messages, reply_words):
+    """Words of the mock reply, prefixed with the turn tag of the last user message"""
+    last_user = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    tag = TAG_PATTERN.search(last_user)
+    words = (REPLY.split() * (reply_words // len(REPLY.split()) + 1))[:reply_words]
+    if tag:
+        words.insert(0, tag.group(0))
+    return [f"{word} " for word in words]
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    settings = MockSettings()
+    requests = RequestLog()
+    prompt_cache = PromptCache()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json({"object": "list", "data": [
+                {"id": model, "object": "model", "created": 0, "owned_by": "mock"}
+                for model in ("gpt-4o", "gpt-4o-mini", "tts-1", "whisper-1")
+            ]})
+        else:
+            self.send_json({"error": {"message": "Not found"}}, status=404)
+
+    def do_POST(self):
+        started = time.time()
+        body = self.read_body()
+        if self.path.endswith("/chat/completions"):
+            self.chat_completions(json.loads(body), started)
+        elif self.path.endswith("/audio/speech"):
+            self.speech(json.loads(body), started)
+        elif self.path.endswith("/audio/transcriptions"):
+            self.transcription(body, started)
+        else:
+            self.send_json({"error": {"message": "Not found"}}, status=404)
+
+    def chat_completions(self, request, started):
+        tokens = reply_tokens(request["messages"], self.settings.reply_words)
+        cached, prompt_tokens = self.prompt_cache.match([m["content"] for m in request["messages"]])
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens),
+                 "prompt_tokens_details": {"cached_tokens": cached}}
+        tag = TAG_PATTERN.match(tokens[0])
+        base = {"id": "chatcmpl-mock", "created": int(started), "model": request["model"]}
+
+        time.sleep(self.settings.ttft)
+        if not request.get("stream"):
+            self.send_json(dict(base, object="chat.completion", usage=usage, choices=[{
+                "index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "".join(tokens).strip()},
+            }]))
+            self.requests.add(endpoint="chat", tag=tag and tag.group(0), stream=False, started=started,
+                              first_token=time.time(), finished=time.time(),
+                              prompt_chars=sum(len(m["content"]) for m in request["messages"]),
+                              prompt_tokens=prompt_tokens, cached_tokens=cached)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        first_token = None
+        try:
+            for token in tokens:
+                self.send_event(dict(base, object="chat.completion.chunk", choices=[{
+                    "index": 0, "delta": {"role": "assistant", "content": token}, "finish_reason": None,
+                }]))
+                first_token = first_token or time.time()
+                time.sleep(self.settings.token_delay)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream, as the app does with the slower of two hedged requests
+            self.close_connection = True
+            self.requests.add(endpoint="chat", tag=tag and tag.group(0), stream=True, started=started,
+                              first_token=first_token, finished=time.time(), cancelled=True,
+                              prompt_chars=sum(len(m["content"]) for m in request["messages"]),
+                              prompt_tokens=prompt_tokens, cached_tokens=cached)
+            return
+        self.send_event(dict(base, object="chat.completion.chunk", choices=[{
+            "index": 0, "delta": {}, "finish_reason": "stop",
+        }]))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self.send_event(dict(base, object="chat.completion.chunk", choices=[], usage=usage))
+        self.send_chunk(b"data: [DONE]\n\n")
+        self.send_chunk(b"")
+        self.requests.add(endpoint="chat", tag=tag and tag.group(0), stream=True, started=started,
+                          first_token=first_token, finished=time.time(),
+                          prompt_chars=sum(len(m["content"]) for m in request["messages"]))
+
+    def send_event(self, payload):
+        self.send_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def speech(self, request, started):
+        text = request["input"]
+        time.sleep(self.settings.tts_latency + self.settings.tts_per_char * len(text))
+        # Roughly the size of a 24 kbps MP3 of the spoken text
+        audio = b"\xff\xf3" + bytes(200 * len(text))
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(len(audio)))
+        self.end_headers()
+        self.wfile.write(audio)
+        tag = TAG_PATTERN.search(text)
+        self.requests.add(endpoint="speech", tag=tag and tag.group(0), started=started,
+                          finished=time.time(), chars=len(text), bytes=len(audio))
+
+    def transcription(self, body, started):
+        time.sleep(self.settings.stt_latency)
+        text = b"I think we can start with the staff and then offer it to the inmates.\n"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+        self.requests.add(endpoint="transcription", tag=None, started=started,
+                          finished=time.time(), bytes=len(body))
+
+
+def start_mock_server(port=0, settings=None, handler_class=None):
+    """Start the mock server on a background thread and return (server, request log)"""
+    handler = type("Handler", (handler_class or MockOpenAIHandler,), {
+        "settings": settings or MockSettings(),
+        "requests": RequestLog(),
+        "prompt_cache": PromptCache(),
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server, handler.requests
+
+
+def add_latency_arguments(parser):
+    parser.add_argument("--ttft", type=float, default=0.5, help="seconds until the first token")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds between tokens")
+    parser.add_argument("--tts-latency", type=float, default=0.3, help="base seconds per speech request")
+    parser.add_argument("--tts-per-char", type=float, default=0.002, help="extra speech seconds per character")
+    parser.add_argument("--stt-latency", type=float, default=0.3, help="seconds per transcription")
+    parser.add_argument("--reply-words", type=int, default=80, help="words in each chat reply")
+
+
+def latency_settings(args):
+    return MockSettings(args.ttft, args.token_delay, args.tts_latency, args.tts_per_char,
+                        args.stt_latency, args.reply_words)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8765)
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+    server, _ = start_mock_server(args.port, latency_settings(args))
+    print(f"Mock OpenAI server on http://127.0.0.1:{server.server_address[1]}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
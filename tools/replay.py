@@ -0,0 +1,223 @@
+"""Replay a recorded session against the app with no network access.
+
+Sessions are recorded by the app when [recording] is enabled in settings.toml.
+Each recording is a gzip JSON Lines file of the student's inputs, the model's
+replies, the speech clips and their timings. This tool serves the recorded
+replies and clip sizes from a local mock of the OpenAI API, with the recorded
+latencies, and types the same inputs into streamlit.app.py through AppTest.
+Each reply is matched to its request by the instruction and the last message,
+so a debrief draft started in the background gets the draft's reply and not
+the next one of Sam's.
+
+The report gives, for each phase (prebrief, sam, debrief): wall time, API calls
+per endpoint, script runs (reruns included) and bytes of page elements sent to
+the browser. Run the same recording on two builds to compare them:
+
+    python tools/replay.py recordings/20260101-101500-abc.jsonl.gz --json before.json
+    python tools/replay.py recordings/20260101-101500-abc.jsonl.gz --baseline before.json
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+from mock_openai import MockOpenAIHandler, MockSettings, RequestLog, ThreadingHTTPServer
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit.app.py")
+PASSWORD = "replay"
+PHASES = ("prebrief", "sam", "debrief")
+
+
+def request_key(messages):
+    """The key the app records with each reply (chat_request_key in streamlit.app.py)"""
+    key = json.dumps([messages[0]["content"], messages[-1]["content"]])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def load_fixture(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class ReplayHandler(MockOpenAIHandler):
+    """Mock OpenAI server that answers with the recorded replies and clip sizes"""
+
+    chat_events = []
+    chat_lock = threading.Lock()
+    speech_events = {}
+    speed = 1.0
+
+    def take_reply(self, request):
+        """The first unused recorded reply to this request; replies of recordings without keys go in order"""
+        key = request_key(request["messages"])
+        with self.chat_lock:
+            for i, event in enumerate(self.chat_events):
+                if event.get("key", key) == key:
+                    return self.chat_events.pop(i)
+        return None
+
+    def chat_completions(self, request, started):
+        event = self.take_reply(request) if request.get("stream") else None
+        if event is None:
+            # Background summaries and anything beyond the recording get the generic mock reply
+            super().chat_completions(request, started)
+            return
+        tokens = [word + " " for word in event["text"].split(" ")]
+        ttft = event["ttft"] * self.speed
+        token_delay = max(event["seconds"] - event["ttft"], 0) * self.speed / max(len(tokens), 1)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(ttft)
+        base = {"id": "chatcmpl-replay", "created": int(started), "model": request["model"],
+                "object": "chat.completion.chunk"}
+        first_token = time.time()
+        cancelled = False
+        try:
+            for token in tokens:
+                self.send_event(dict(base, choices=[{"index": 0, "delta": {"content": token}, "finish_reason": None}]))
+                time.sleep(token_delay)
+            self.send_event(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+            self.send_chunk(b"data: [DONE]\n\n")
+            self.send_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # The app closed the stream, as it does with a cancelled debrief draft
+            self.close_connection = True
+            cancelled = True
+        self.requests.add(endpoint="chat", tag=None, stream=True, started=started,
+                          first_token=first_token, finished=time.time(), cancelled=cancelled,
+                          prompt_chars=sum(len(m["content"]) for m in request["messages"]))
+
+    def speech(self, request, started):
+        event = self.speech_events.get(request["input"])
+        if event is None:
+            super().speech(request, started)
+            return
+        time.sleep(event["seconds"] * self.speed)
+        audio = b"\xff\xf3" + bytes(max(event["bytes"] - 2, 0))
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(len(audio)))
+        self.end_headers()
+        self.wfile.write(audio)
+        self.requests.add(endpoint="speech", tag=None, started=started, finished=time.time(),
+                          chars=len(request["input"]), bytes=len(audio))
+
+
+def start_replay_server(events, speed):
+    handler = type("Handler", (ReplayHandler,), {
+        "settings": MockSettings(),
+        "requests": RequestLog(),
+        "chat_events": [e for e in events if e["kind"] in ("chat", "draft")],
+        "speech_events": {e["text"]: e for e in events if e["kind"] == "speech"},
+        "speed": speed,
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="replay-openai", daemon=True).start()
+    return server, handler.requests
+
+
+def element_bytes(node):
+    """Serialized size of the page elements under node, as sent to the browser"""
+    size = node.proto.ByteSize() if getattr(node, "proto", None) is not None else 0
+    for child in getattr(node, "children", {}).values():
+        size += element_bytes(child)
+    return size
+
+
+class Replayer:
+    """Types recorded inputs into the app and measures every step by phase"""
+
+    def __init__(self, requests, timeout):
+        from streamlit.testing.v1 import AppTest
+
+        self.requests = requests
+        self.app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.app.secrets["OPENAI_API_KEY"] = "sk-replay"
+        self.app.secrets["password"] = PASSWORD
+        self.totals = {phase: {"steps": 0, "wall_seconds": 0.0, "script_runs": 0, "browser_bytes": 0,
+                               "api_calls": {"chat": 0, "speech": 0, "transcription": 0}}
+                       for phase in PHASES}
+
+    def step(self, action, phase="prebrief"):
+        state = self.app.session_state
+        runs_before = state["script_runs"] if "script_runs" in state else 0
+        calls_before = len(self.requests.snapshot())
+        started = time.time()
+        action.run()
+        if self.app.exception:
+            raise RuntimeError(self.app.exception[0].message)
+        totals = self.totals[phase]
+        totals["steps"] += 1
+        totals["wall_seconds"] += time.time() - started
+        totals["script_runs"] += state["script_runs"] - runs_before
+        totals["browser_bytes"] += element_bytes(self.app._tree)
+        for entry in self.requests.snapshot()[calls_before:]:
+            totals["api_calls"][entry["endpoint"]] += 1
+
+    def run(self, events):
+        self.step(self.app)
+        self.app.text_input(key="password").input(PASSWORD)
+        self.step(self.app.button[0].click())
+        for event in events:
+            if event["kind"] == "user":
+                self.step(self.app.chat_input[0].set_value(event["text"]), event["phase"])
+        return self.totals
+
+
+def print_report(totals, baseline=None):
+    print(f"{'phase':<9} {'steps':>5} {'wall s':>8} {'runs':>5} {'chat':>5} {'speech':>6} {'KB sent':>9}")
+    for phase in PHASES:
+        t = totals[phase]
+        print(f"{phase:<9} {t['steps']:>5} {t['wall_seconds']:>8.2f} {t['script_runs']:>5} "
+              f"{t['api_calls']['chat']:>5} {t['api_calls']['speech']:>6} {t['browser_bytes'] / 1024:>9.1f}")
+        if baseline:
+            b = baseline[phase]
+            print(f"{'  change':<9} {t['steps'] - b['steps']:>+5} {t['wall_seconds'] - b['wall_seconds']:>+8.2f} "
+                  f"{t['script_runs'] - b['script_runs']:>+5} "
+                  f"{t['api_calls']['chat'] - b['api_calls']['chat']:>+5} "
+                  f"{t['api_calls']['speech'] - b['api_calls']['speech']:>+6} "
+                  f"{(t['browser_bytes'] - b['browser_bytes']) / 1024:>+9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("recording", help="gzip JSON Lines recording made by the app")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="multiply the recorded latencies, e.g. 0 to replay without waiting")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds allowed per script run")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="report from an earlier build to compare against")
+    args = parser.parse_args()
+
+    events = load_fixture(args.recording)
+    server, requests = start_replay_server(events, args.speed)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.chdir(os.path.dirname(APP_PATH))
+
+    totals = Replayer(requests, args.timeout).run(events)
+
+    skipped = [e for e in events if e["kind"] == "transcription"]
+    if skipped:
+        print(f"Note: {len(skipped)} voice inputs were replayed as typed text.", file=sys.stderr)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(totals, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(totals, f, indent=2)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()